@@ -1,14 +1,18 @@
 from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtGui import QTextCursor
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QTextEdit, QLabel, QSizePolicy, QScrollArea, QPushButton
+    QTextEdit, QLabel, QScrollArea, QPushButton, QFileDialog, QMessageBox
 )
-import re
 
-import float_slider, graph, r_runner
-from constants import EXAMPLES_LIST, EXAMPLES_DIR, PLACEHOLDER_TEXT, APP_TITLE, SLIDER_REGEX_PATTERN, SLIDER_REGEX_CAPTURE_PATTERN
+import graph, r_runner, r_worker, scheduler, slider_row, sliders, sweep, timing
+from constants import EXAMPLES_LIST, EXAMPLES_DIR, PLACEHOLDER_TEXT, APP_TITLE, PREFETCH_OFFSETS, SWEEP_MAX_SLIDERS, ANIMATION_INTERVAL_MS, SCHEDULER_FRAME_MS, EDITOR_DEBOUNCE_MS, SLIDER_PRIORITY, EDITOR_PRIORITY
 
 
+# file dialog filters of "Export timings"
+TIMING_JSON_FILTER = "Timings (*.json)"
+TIMING_TRACE_FILTER = "Chrome trace, for chrome://tracing or Perfetto (*.json)"
+
 COMMAND_BOX_CSS = """
 QTextEdit {
     color: black;
@@ -31,6 +35,27 @@ class MainWindow(QMainWindow):
         self.slider_widgets = []
         self.current_slider_lines = []
 
+        self.r_worker = r_worker.Worker()
+        self.r_worker.entries_ready.connect(self.show_entries)
+        self.r_worker.result_ready.connect(self.show_result)
+        self.r_worker.start()
+
+        # the request whose output is being streamed into the graph, and what arrived of it so far
+        self.streaming_request = None
+        self.streaming_entries = []
+        # last complete result on screen, put back when a streamed script fails half way through
+        self.shown_result = []
+
+        # every edit and slider move goes through here, see schedule_edit / schedule_slider_move
+        self.scheduler = scheduler.Scheduler(SCHEDULER_FRAME_MS, self)
+
+        self.sweeper = None
+        self.sweep_table = None
+
+        self.animation_timer = QTimer(self)
+        self.animation_timer.setInterval(ANIMATION_INTERVAL_MS)
+        self.animation_timer.timeout.connect(self.advance_animation)
+
         self.init_layout()
     
     def init_layout(self):
@@ -85,7 +110,7 @@ class MainWindow(QMainWindow):
         self.command_textbox = QTextEdit()
         self.command_textbox.setPlaceholderText(PLACEHOLDER_TEXT)
         self.command_textbox.setStyleSheet(COMMAND_BOX_CSS)
-        self.command_textbox.textChanged.connect(self.update_sliders)
+        self.command_textbox.textChanged.connect(self.schedule_edit)
         top_left_layout.addWidget(self.command_textbox, stretch=2)
 
         self.R_output_box = QTextEdit()
@@ -106,6 +131,26 @@ class MainWindow(QMainWindow):
         plot_type_button.clicked.connect(self.graph_widget.toggle_points)
         bottom_left_buttons_layout.addWidget(plot_type_button)
 
+        reset_view_button = QPushButton("Reset view")
+        reset_view_button.clicked.connect(self.graph_widget.reset_view)
+        bottom_left_buttons_layout.addWidget(reset_view_button)
+
+        self.sweep_button = QPushButton("Precompute sweep")
+        self.sweep_button.clicked.connect(self.toggle_sweep)
+        bottom_left_buttons_layout.addWidget(self.sweep_button)
+
+        self.play_button = QPushButton("Play animation")
+        self.play_button.clicked.connect(self.toggle_animation)
+        bottom_left_buttons_layout.addWidget(self.play_button)
+
+        timing_button = QPushButton("Toggle timing overlay")
+        timing_button.clicked.connect(self.graph_widget.toggle_timing_overlay)
+        bottom_left_buttons_layout.addWidget(timing_button)
+
+        export_timing_button = QPushButton("Export timings")
+        export_timing_button.clicked.connect(self.export_timings)
+        bottom_left_buttons_layout.addWidget(export_timing_button)
+
         left_layout.addWidget(bottom_left_buttons_widget)
 
 
@@ -120,7 +165,8 @@ class MainWindow(QMainWindow):
             self.command_textbox.setText(file.read())
         
         self.current_example_label.setText(f'example {self.current_example_index}\n{EXAMPLES_LIST[self.current_example_index]}')
-        self.update_sliders()
+        self.scheduler.cancel('edit')
+        self.update_sliders(keep_values=False)
 
     def cycle_next_example(self):
         self.current_example_index += 1
@@ -132,123 +178,235 @@ class MainWindow(QMainWindow):
             self.command_textbox.setText(file.read())
         
         self.current_example_label.setText(f'example {self.current_example_index}\n{EXAMPLES_LIST[self.current_example_index]}')
-        self.update_sliders()
+        self.scheduler.cancel('edit')
+        self.update_sliders(keep_values=False)
+
 
 
 
+    def schedule_edit(self):
+        self.scheduler.schedule('edit', self.update_sliders, EDITOR_PRIORITY, EDITOR_DEBOUNCE_MS)
 
-    def update_sliders(self):
-        new_slider_lines = []
+    # moves of any slider share one task, the last moved slider gets its neighbours prefetched
+    def schedule_slider_move(self):
+        moved_slider = self.sender()
+        self.scheduler.schedule('slider', lambda: self.update_graph(moved_slider), SLIDER_PRIORITY)
 
-        commands = self.command_textbox.toPlainText().strip().split("\n")
-        for cmd in commands:
-            match = re.search(SLIDER_REGEX_CAPTURE_PATTERN, cmd)
-            if match:
-                new_slider_lines.append(cmd)
+    # slider rows are matched to the new slider lines by variable name (and which occurrence of it),
+    # rows that are still there keep their widget and value, only added, removed and changed ones are touched
+    # keep_values=False starts every slider over (a different example was loaded)
+    def update_sliders(self, keep_values=True):
+        new_slider_lines = sliders.slider_lines(self.command_textbox.toPlainText())
 
-        if new_slider_lines == self.current_slider_lines:
+        if new_slider_lines == self.current_slider_lines and keep_values:
             self.update_graph()
             return
 
-        self.current_slider_lines = new_slider_lines.copy()
-
-        for container in self.slider_containers:
-            container.deleteLater()
-        self.slider_containers.clear()
-        self.slider_widgets.clear()
-
-        for i in range(len(new_slider_lines)):
-            match = re.search(SLIDER_REGEX_CAPTURE_PATTERN, new_slider_lines[i])
-            try:
-                name = new_slider_lines[i].split('<-')[0].strip()
-                parts = [p.strip() for p in match.group(1).split(',')]
-                min_val = float(parts[0])
-                max_val = float(parts[1])
-                step_val = float(parts[2]) if len(parts) > 2 else 1
-                default_val = float(parts[3]) if len(parts) > 3 else min_val
-            except:
-                new_slider_lines[i] = ''
+        self.current_slider_lines = new_slider_lines
+
+        old_rows = {}
+        if keep_values:
+            for row in self.slider_containers:
+                old_rows.setdefault(row.spec.name, []).append(row)
+
+        rows = []
+        for line in new_slider_lines:
+            spec = sliders.parse_line(line)
+            if spec is None:
                 continue # if we fail to parse, just invalidate this line
-            
-            if step_val == 0:
-                new_slider_lines[i] = ''
-                continue # prevent division by 0
-
-            container = QWidget()
-            container.setContentsMargins(5, 5, 5, 5)
-            layout = QHBoxLayout(container)
-            
-            info_label = QLabel(f"{min_val}-{max_val}\nStep: {step_val}")
-            info_label.setFixedWidth(100)
-
-            value_label = QLabel()
-            value_label.setFixedWidth(60)
-            value_label.setAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-            
-            slider = float_slider.Widget(min_val, max_val, step_val, default_val, value_label, name, Qt.Orientation.Horizontal)
-            slider.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
-            
-            slider.valueChanged.connect(self.update_graph)
-            
-            layout.addWidget(info_label)
-            layout.addWidget(slider)
-            layout.addWidget(value_label)
-            
-            self.right_layout.addWidget(container)
-            self.slider_containers.append(container)
-            self.slider_widgets.append(slider)
+
+            candidates = old_rows.get(spec.name)
+            if candidates:
+                row = candidates.pop(0)
+                if row.spec != spec:
+                    row.update_spec(spec)
+            else:
+                row = slider_row.Widget(spec)
+                row.slider.valueChanged.connect(self.schedule_slider_move)
+            rows.append(row)
+
+        kept_rows = set(rows)
+        for row in self.slider_containers:
+            if row not in kept_rows:
+                self.right_layout.removeWidget(row)
+                row.deleteLater()
+
+        for index, row in enumerate(rows):
+            if self.right_layout.indexOf(row) != index:
+                self.right_layout.removeWidget(row)
+                self.right_layout.insertWidget(index, row)
+
+        self.slider_containers = rows
+        self.slider_widgets = [row.slider for row in rows]
 
         self.update_graph()
 
 
 
 
-    def update_graph(self):
+    def update_graph(self, moved_slider=None):
         slider_values = []
         for slider in self.slider_widgets:
             slider_values.append(slider.get_value())
-        
+
         code = self.command_textbox.toPlainText()
 
-        index = 0
-        def replace_match(match):
-            nonlocal index
-            if index < len(slider_values):
-                index += 1
-                return str(slider_values[index - 1])
+        if self.sweep_table is not None:
+            if self.sweep_table.code != code:
+                self.stop_sweep()
             else:
-                return match.group()
-        
-        result = r_runner.run_r_script(SLIDER_REGEX.sub(replace_match, code))
-
+                result = self.sweep_table.lookup([slider.value() for slider in self.slider_widgets])
+                if result is not None:
+                    self.r_worker.cancel()
+                    self.streaming_request = None
+                    self.display_result(result)
+                    return
+
+        with timing.measure(timing.SUBSTITUTE):
+            script = sliders.substitute(code, slider_values)
+        self.r_worker.submit(script)
+
+        # while a slider is dragged, let idle R processes compute its neighbouring steps
+        if moved_slider in self.slider_widgets:
+            slider_index = self.slider_widgets.index(moved_slider)
+            for offset in PREFETCH_OFFSETS:
+                value = moved_slider.get_value_at_offset(offset)
+                if value is None:
+                    continue
+                neighbour_values = slider_values.copy()
+                neighbour_values[slider_index] = value
+                r_runner.prefetch_r_script(sliders.substitute(code, neighbour_values))
+
+    # the graph is cleared when the first output of a new request arrives, then filled as R goes
+    def show_entries(self, request_id, entries):
+        if not self.r_worker.is_latest(request_id):
+            return # a newer slider / code state is already on its way
+        if self.streaming_request != request_id:
+            self.streaming_request = request_id
+            self.streaming_entries = []
+            self.graph_widget.begin_update()
+            self.R_output_box.clear()
+        self.streaming_entries.extend(entries)
+        self.draw_entries(entries)
+
+    # what is on screen while streaming may also be the partial output of an older request
+    # that this one superseded before printing anything, it is replaced by the last complete result
+    def show_result(self, request_id, error):
+        if not self.r_worker.is_latest(request_id):
+            return
+        if error is None and self.streaming_request == request_id:
+            self.shown_result = self.streaming_entries
+            self.graph_widget.finish_update()
+        elif self.streaming_request is not None:
+            self.graph_widget.begin_update()
+            self.R_output_box.clear()
+            self.draw_entries(self.shown_result)
+            self.graph_widget.finish_update()
+        if error is not None:
+            self.show_error(error)
+        self.streaming_request = None
+        self.streaming_entries = []
+
+    # plain script errors happen all the time while typing and only go to the console,
+    # a killed R process is worth telling the user about
+    def show_error(self, error):
+        if isinstance(error, (r_runner.RTimeoutError, r_runner.RProcessDiedError)):
+            self.R_output_box.append(f"Evaluation stopped: {error}")
+        elif isinstance(error, r_runner.RSyntaxError):
+            print(f"Syntax error: {error}")
+        else:
+            print(f"R Error: {error}")
+
+    def display_result(self, result):
         if result:
-            self.graph_widget.clear()
-            i = 0
-            R_output = ""
-            while i < len(result):
-                unknown = result[i].strip()
-                i += 1
+            self.graph_widget.begin_update()
+            self.R_output_box.clear()
+            self.draw_entries(result)
+            self.graph_widget.finish_update()
+            self.shown_result = result
+
+    def draw_entries(self, entries):
+        R_output = ""
+        for entry in entries:
+            if isinstance(entry, dict):
+                self.graph_widget.add_line_data(entry['xs'], entry['ys'], *entry['x_range'], *entry['y_range'], entry['name'])
+            else:
+                R_output += f"{entry}\n"
+        if R_output:
+            self.R_output_box.moveCursor(QTextCursor.MoveOperation.End)
+            self.R_output_box.insertPlainText(R_output)
+
+
 
-                if unknown == 'custom_line_plot':
-                    try:
-                        xs = [float(v) for v in result[i].split(',')]
-                        ys = [float(v) for v in result[i+1].split(',')]
-                        xmi, xmx = [float(v) for v in result[i+2].split(',')]
-                        ymi, ymx = [float(v) for v in result[i+3].split(',')]
-                        name = result[i+4].strip()
-                        i += 5
-                    except (IndexError, ValueError) as e:
-                        print(f"Parse error: {e}")
-                        return
-                    self.graph_widget.add_line_data(xs,ys,xmi,xmx,ymi,ymx,name)
-                else:
-                    R_output += f"{unknown}\n"
-            self.R_output_box.setPlainText(R_output)
 
+    def toggle_sweep(self):
+        if self.sweeper is not None and self.sweeper.isRunning():
+            self.sweeper.cancel()
+            return
 
+        if not 1 <= len(self.slider_widgets) <= SWEEP_MAX_SLIDERS:
+            self.R_output_box.setPlainText(f"Precomputing a sweep needs 1 to {SWEEP_MAX_SLIDERS} sliders")
+            return
 
+        code = self.command_textbox.toPlainText()
+        self.sweeper = sweep.Sweeper(
+            code,
+            [slider.get_all_values() for slider in self.slider_widgets],
+            lambda values: sliders.substitute(code, values)
+        )
+        # cells become usable as soon as they are computed
+        self.sweep_table = self.sweeper.table
+        self.sweeper.progress.connect(self.show_sweep_progress)
+        self.sweeper.stopped.connect(self.sweep_stopped)
+        self.sweeper.start()
+        self.sweep_button.setText("Cancel sweep")
+
+    def stop_sweep(self):
+        self.sweep_table = None
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+
+    def show_sweep_progress(self, done, total):
+        self.sweep_button.setText(f"Cancel sweep ({100 * done // total}%)")
+
+    def sweep_stopped(self, reason):
+        self.sweep_button.setText("Precompute sweep")
+        if reason is not None:
+            self.R_output_box.append(f"Sweep stopped: {reason}")
+
+    def export_timings(self):
+        path, selected_filter = QFileDialog.getSaveFileName(self, "Export timings", "timings.json", f"{TIMING_JSON_FILTER};;{TIMING_TRACE_FILTER}")
+        if not path:
+            return
+        if selected_filter == TIMING_TRACE_FILTER:
+            timing.RECORDER.export_chrome_trace(path)
+        else:
+            timing.RECORDER.export_json(path)
+
+    def toggle_animation(self):
+        if self.animation_timer.isActive():
+            self.animation_timer.stop()
+            self.play_button.setText("Play animation")
+        elif self.slider_widgets:
+            self.animation_timer.start()
+            self.play_button.setText("Pause animation")
+
+    # steps the first slider, wrapping around at the end
+    def advance_animation(self):
+        if not self.slider_widgets:
+            self.toggle_animation()
+            return
+        slider = self.slider_widgets[0]
+        slider.setValue(slider.value() + 1 if slider.value() < slider.maximum() else slider.minimum())
+
+    def stop_background_work(self):
+        self.animation_timer.stop()
+        self.scheduler.clear()
+        self.stop_sweep()
+        if self.sweeper is not None:
+            self.sweeper.wait()
+        self.r_worker.stop()
 
-SLIDER_REGEX = 'NOT_YET_INITIALIZED'
 
 
 
@@ -256,15 +414,24 @@ APP_INSTANCE = 'NOT_YET_INITIALIZED'
 WINDOW_INSTANCE = 'NOT_YET_INITIALIZED'
 
 def init(args):
-    global APP_INSTANCE, WINDOW_INSTANCE, SLIDER_REGEX
-    SLIDER_REGEX = re.compile(SLIDER_REGEX_PATTERN)
+    global APP_INSTANCE, WINDOW_INSTANCE
 
     APP_INSTANCE = QApplication(args)
     WINDOW_INSTANCE = MainWindow()
+    APP_INSTANCE.aboutToQuit.connect(WINDOW_INSTANCE.stop_background_work)
     QTimer.singleShot(0, WINDOW_INSTANCE.cycle_next_example)
 
 
 def run():
     WINDOW_INSTANCE.show()
     exit_code = APP_INSTANCE.exec()
-    return exit_code
\ No newline at end of file
+    return exit_code
+
+# used instead of init / run when R could not be started, without it there is nothing to evaluate scripts with
+def show_startup_error(args, error):
+    global APP_INSTANCE
+
+    print(f"!!! UNABLE TO START R: {error}")
+    APP_INSTANCE = QApplication(args)
+    QMessageBox.critical(None, APP_TITLE, f"Unable to start R:\n{error}")
+    return 1
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from array import array
+
+# benchmark suite for the hot paths between R and the screen, results go out as JSON
+#
+#   python benchmarks/run.py                 # against the R on PATH
+#   python benchmarks/run.py --stub          # against benchmarks/stub_r.py, no R needed
+#   python benchmarks/run.py --record        # save what R answers for every example, for the stub to replay
+#
+# every result is {"benchmark", "case", "unit", "samples", "median", "min", "max"} plus extra numbers
+# (like bytes per sample) where a throughput makes more sense than a time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_R = os.path.join(ROOT, "benchmarks", "stub_r.py")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from constants import EXAMPLES_DIR, EXAMPLES_LIST
+import r_protocol, r_runner, sliders
+from benchmarks import stub_r
+
+SERIES_SIZES = [1000, 100000, 1000000]
+# several short series at once, the usual output of a script, where the cost per drawing call dominates
+SMALL_SERIES_SIZES = [200, 1000, 5000]
+SMALL_SERIES_COUNT = 3
+WIDGET_WIDTH = 1200
+WIDGET_HEIGHT = 800
+
+
+def result(benchmark, case, samples, unit="s", **extra):
+    entry = {
+        "benchmark": benchmark,
+        "case": case,
+        "unit": unit,
+        "samples": samples,
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+    }
+    entry.update(extra)
+    return entry
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+# (name, script with every slider at its initial value, the same with the first slider one step further)
+def load_examples():
+    examples = []
+    for name in EXAMPLES_LIST:
+        with open(os.path.join(ROOT, EXAMPLES_DIR, f"{name}.R")) as file:
+            code = file.read()
+        specs = [spec for spec in map(sliders.parse_line, sliders.slider_lines(code)) if spec is not None]
+        values = [spec.initial_value() for spec in specs]
+        moved = list(values)
+        if specs:
+            steps = specs[0].values()
+            moved[0] = steps[1] if len(steps) > 1 and values[0] == steps[0] else steps[0]
+        examples.append((name, sliders.substitute(code, values), sliders.substitute(code, moved)))
+    return examples
+
+# sorted, noisy sine, the shape most plot_line calls have
+def synthetic_series(size, seed=0):
+    generator = random.Random(seed)
+    xs = array('d', (i / size * 20 - 10 for i in range(size)))
+    ys = array('d', (math.sin(x) + generator.gauss(0, 0.1) for x in xs))
+    return xs, ys
+
+
+# cold: a new R process and its first script, warm: the same process again, unchanged and with a slider moved
+def bench_r_round_trip(examples, repeats):
+    results = []
+    for name, script, moved_script in examples:
+        spawn_samples, first_samples = [], []
+        for _ in range(max(1, repeats // 5)):
+            start = time.perf_counter()
+            process = r_runner.spawn_warm_process()
+            spawned = time.perf_counter()
+            try:
+                process.run(script)
+            except r_runner.RScriptError:
+                pass
+            first_samples.append(time.perf_counter() - spawned)
+            spawn_samples.append(spawned - start)
+            process.close()
+        results.append(result("r_round_trip", f"{name}: spawn", spawn_samples))
+        results.append(result("r_round_trip", f"{name}: cold run", first_samples))
+
+        process = r_runner.spawn_warm_process()
+        for case, scripts in (("warm run", [script]), ("warm run, slider moved", [moved_script, script])):
+            samples = []
+            for i in range(repeats):
+                try:
+                    samples.append(timed(process.run, scripts[i % len(scripts)]))
+                except r_runner.RScriptError:
+                    break
+            if samples:
+                results.append(result("r_round_trip", f"{name}: {case}", samples))
+        process.close()
+    return results
+
+
+# decoding a response into result entries: one plot of the given size plus a screenful of text
+def bench_parse(repeats):
+    results = []
+    text = "".join(f"[{i}] {i * 0.5}\n" for i in range(100)).encode()
+    for size in SERIES_SIZES:
+        xs, ys = synthetic_series(size)
+        payload = stub_r.plot_payload("series", xs, ys)
+        data = stub_r.frame(1, r_protocol.OUTPUT, text) + stub_r.frame(1, r_protocol.PLOT, payload) + stub_r.frame(1, r_protocol.END, b"")
+
+        def decode():
+            channel = io.BytesIO(data)
+            while True:
+                _, kind, frame_payload = r_protocol.read_frame(channel)
+                if kind == r_protocol.END:
+                    return
+                r_protocol.decode_entries(kind, frame_payload)
+
+        samples = [timed(decode) for _ in range(repeats)]
+        results.append(result("parse", f"{size} points", samples, bytes=len(data),
+                              mb_per_s=len(data) / statistics.median(samples) / 1e6))
+    return results
+
+
+def bench_add_line_data(widget, repeats):
+    results = []
+    for size in SERIES_SIZES:
+        xs, ys = synthetic_series(size)
+        x_range, y_range = (min(xs), max(xs)), (min(ys), max(ys))
+        samples = []
+        for _ in range(repeats):
+            widget.clear()
+            samples.append(timed(widget.add_line_data, xs, ys, *x_range, *y_range, "series"))
+        results.append(result("add_line_data", f"{size} points", samples))
+    return results
+
+
+# first paint builds the caches (layers, decimation, screen polygons), the later ones reuse them
+def bench_paint(widget, repeats):
+    from PyQt6.QtGui import QImage
+
+    results = []
+    image = QImage(WIDGET_WIDTH, WIDGET_HEIGHT, QImage.Format.Format_ARGB32_Premultiplied)
+    for draw_points in (False, True):
+        widget.draw_points = draw_points
+        for size in SERIES_SIZES:
+            xs, ys = synthetic_series(size)
+            cold_samples, warm_samples = [], []
+            for _ in range(max(1, repeats // 5)):
+                widget.clear()
+                widget.add_line_data(xs, ys, min(xs), max(xs), min(ys), max(ys), "series")
+                cold_samples.append(timed(widget.render, image))
+            for _ in range(repeats):
+                warm_samples.append(timed(widget.render, image))
+            kind = "points" if draw_points else "lines"
+            results.append(result("paint", f"{size} {kind}, first paint", cold_samples))
+            results.append(result("paint", f"{size} {kind}, repaint", warm_samples))
+    widget.draw_points = False
+
+    for size in SMALL_SERIES_SIZES:
+        widget.clear()
+        for k in range(SMALL_SERIES_COUNT):
+            xs, ys = synthetic_series(size, seed=k)
+            widget.add_line_data(xs, ys, min(xs), max(xs), min(ys), max(ys), f"series {k}")
+        samples = [timed(widget.render, image) for _ in range(repeats)]
+        results.append(result("paint", f"{SMALL_SERIES_COUNT} x {size} lines, repaint", samples))
+    return results
+
+
+# runs every example once and keeps the raw frames R answered with, keyed like stub_r looks them up
+def record(examples):
+    os.makedirs(stub_r.CANNED_DIR, exist_ok=True)
+    process = r_runner.spawn_warm_process()
+    for name, script, moved_script in examples:
+        for variant in (script, moved_script):
+            request_id = process.submit(variant)
+            frames = []
+            while True:
+                frame_request, kind, payload = r_protocol.read_frame(process.response_channel)
+                if frame_request != request_id:
+                    continue
+                frames.append(stub_r.frame(0, kind, payload))
+                if kind == r_protocol.END:
+                    break
+            with open(os.path.join(stub_r.CANNED_DIR, stub_r.script_key(variant) + ".frames"), "wb") as file:
+                file.write(b"".join(frames))
+        print(f"recorded {name}", file=sys.stderr)
+    process.close()
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="Benchmark the R round trip, response parsing and painting.")
+    parser.add_argument("--stub", action="store_true", help="use benchmarks/stub_r.py instead of R")
+    parser.add_argument("--record", action="store_true", help="record R's answers to the examples for --stub and exit")
+    parser.add_argument("--only", default="r_round_trip,parse,add_line_data,paint", help="comma separated benchmarks to run")
+    parser.add_argument("--repeats", type=int, default=10, help="samples per case")
+    parser.add_argument("-o", "--output", help="write the JSON here instead of stdout")
+    return parser.parse_args(args)
+
+
+def main(args):
+    options = parse_args(args)
+    if options.stub:
+        r_runner.R_COMMAND = [sys.executable, STUB_R]
+
+    examples = load_examples()
+    if options.record:
+        record(examples)
+        return 0
+
+    selected = options.only.split(",")
+    results = []
+    if "r_round_trip" in selected:
+        results += bench_r_round_trip(examples, options.repeats)
+    if "parse" in selected:
+        results += bench_parse(options.repeats)
+    if "add_line_data" in selected or "paint" in selected:
+        from PyQt6.QtWidgets import QApplication
+        import graph
+
+        application = QApplication([])
+        widget = graph.Widget()
+        widget.resize(WIDGET_WIDTH, WIDGET_HEIGHT)
+        if "add_line_data" in selected:
+            results += bench_add_line_data(widget, options.repeats)
+        if "paint" in selected:
+            results += bench_paint(widget, options.repeats)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "r_command": r_runner.R_COMMAND,
+            "repeats": options.repeats,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
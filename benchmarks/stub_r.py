@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import hashlib
+import math
+import os
+import re
+import socket
+import struct
+import sys
+
+# stands in for `R --slave` so the python side can be benchmarked without R installed
+# it understands just enough of what r_runner writes to stdin: the response channel line and serve() calls
+# every served script is answered from benchmarks/canned/<sha256 of the script>.frames when that
+# recording exists (see run.py --record), otherwise with a synthetic result: one text line and one
+# plot of STUB_R_POINTS points (default 1000)
+
+CANNED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "canned")
+HEADER = struct.Struct("<iii")
+OUTPUT, PLOT, END = 1, 2, 4
+
+PORT_PATTERN = re.compile(r'^\.response_con <- socketConnection\(.*port = (\d+)')
+SERVE_PATTERN = re.compile(r'^\.helpers\$serve\((\d+), "(.*)", (TRUE|FALSE)\)$', re.DOTALL)
+
+
+def unescape(literal):
+    return re.sub(r'\\(.)', lambda match: match.group(1), literal, flags=re.DOTALL)
+
+def script_key(script):
+    return hashlib.sha256(script.encode()).hexdigest()
+
+
+def frame(request_id, kind, payload):
+    return HEADER.pack(request_id, kind, len(payload)) + payload
+
+def plot_payload(name, xs, ys):
+    name = name.encode()
+    payload = [struct.pack("<i", len(name)), name]
+    for block in (xs, ys, (min(xs), max(xs)), (min(ys), max(ys))):
+        payload.append(struct.pack(f"<i{len(block)}d", len(block), *block))
+    return b"".join(payload)
+
+# (channel, payload) pairs, built once
+SYNTHETIC_FRAMES = 'NOT_YET_INITIALIZED'
+
+def synthetic_response(request_id):
+    global SYNTHETIC_FRAMES
+    if SYNTHETIC_FRAMES == 'NOT_YET_INITIALIZED':
+        points = int(os.environ.get("STUB_R_POINTS", "1000"))
+        xs = [i / points * 20 - 10 for i in range(points)]
+        ys = [math.sin(x) for x in xs]
+        SYNTHETIC_FRAMES = [(OUTPUT, b"stub output\n"), (PLOT, plot_payload("stub", xs, ys))]
+    return b"".join(frame(request_id, kind, payload) for kind, payload in SYNTHETIC_FRAMES)
+
+# a recording is a sequence of frames as R sent them, request ids are rewritten to the current one
+def canned_response(request_id, script):
+    path = os.path.join(CANNED_DIR, script_key(script) + ".frames")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        data = file.read()
+
+    frames = []
+    offset = 0
+    while offset < len(data):
+        _, kind, length = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        if kind != END:
+            frames.append(frame(request_id, kind, data[offset:offset + length]))
+        offset += length
+    return b"".join(frames)
+
+
+def main():
+    connection = None
+    pending = ""
+    for line in sys.stdin:
+        match = PORT_PATTERN.match(line)
+        if match:
+            connection = socket.create_connection(("127.0.0.1", int(match.group(1))))
+            continue
+
+        # a serve() call spans several lines when the script does
+        if not pending and not line.startswith(".helpers$serve("):
+            continue
+        pending += line
+        match = SERVE_PATTERN.match(pending.rstrip("\n"))
+        if not match:
+            continue
+        pending = ""
+
+        request_id = int(match.group(1))
+        script = unescape(match.group(2))
+        response = canned_response(request_id, script)
+        if response is None:
+            response = synthetic_response(request_id)
+        connection.sendall(response + frame(request_id, END, b""))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,19 @@
-import random
 from colorsys import hsv_to_rgb
 from PyQt6.QtGui import QColor
 
 from constants import NUM_MAX_COLORS
 
-CURRENT_COLOR_INDEX = 0
+# color of the n-th curve, starting half way round the hue circle and stepping 7 hues at a time
+# it only depends on n, so a curve keeps its color however many times the graph is redrawn
+def color(n):
+    return hue_color((NUM_MAX_COLORS / 2 + 7 * n) % NUM_MAX_COLORS)
 
-def reset():
-    global CURRENT_COLOR_INDEX
-    CURRENT_COLOR_INDEX = NUM_MAX_COLORS / 2
-
-def next():
-    global CURRENT_COLOR_INDEX
-    CURRENT_COLOR_INDEX = CURRENT_COLOR_INDEX % NUM_MAX_COLORS
-    
-    hue = CURRENT_COLOR_INDEX * (1.0 / NUM_MAX_COLORS) # Evenly spaced hues
+def hue_color(index):
+    hue = index * (1.0 / NUM_MAX_COLORS) # Evenly spaced hues
     saturation = 0.7
     value = 0.7
 
     r, g, b = hsv_to_rgb(hue, saturation, value)
     r, g, b = int(r * 255), int(g * 255), int(b * 255)
 
-    CURRENT_COLOR_INDEX += 7
-
     return QColor(r, g, b)
@@ -1,3 +1,5 @@
+import os
+
 APP_TITLE = "Interactive R graph visualizer"
 
 NUM_MAX_COLORS = 100
@@ -28,12 +30,14 @@ custom functions:
         # NOTE: this function cannot take variables as inputs. just int/float literals
     OUTPUT:
         plot_line(xs, ys, [name])
-        plot_func(func, xs, [name])
+        plot_func(func, xs, [name], [adaptive = FALSE], [max_points = 2000], [vectorized = NA])
+        # func(xs) is tried first, func is called once per x if that fails
+        # adaptive = TRUE samples range(xs) densely where the curve bends, with at most max_points points
 """
 
 
+# installed once per R process into the .helpers environment, scripts are evaluated in a child of it
 CUSTOM_R_CODE = """
-rm(list=ls())
 print_comma_separated <- function(x) {{
     cat(paste(x, collapse = ","), "\n")
 }}
@@ -46,19 +50,348 @@ plot_points <- function(xs, ys) {{
         plot_point(xs[i], ys[i])
     }}
 }}
+
+# framed responses over .response_con, see r_protocol.py for the layout (channel numbers are the same)
+protocol <- new.env()
+protocol$request <- 0L
+
+write_frame_header <- function(channel, length) {{
+    writeBin(c(protocol$request, channel, as.integer(length)), .response_con, size = 4, endian = "little")
+}}
+write_text_frame <- function(channel, text) {{
+    bytes <- charToRaw(enc2utf8(paste(text, collapse = "")))
+    write_frame_header(channel, length(bytes))
+    writeBin(bytes, .response_con)
+    flush(.response_con)
+}}
+write_float64_block <- function(x) {{
+    writeBin(length(x), .response_con, size = 4, endian = "little")
+    writeBin(x, .response_con, size = 8, endian = "little")
+}}
+# everything that can warn (like range() of an empty vector) runs before the header is written,
+# the OUTPUT frame of a warning would otherwise end up inside this one
+# the ranges skip NA / NaN / Inf, a series without a finite value gets (Inf, -Inf)
+emit_line_plot <- function(xs, ys, name) {{
+    xs <- as.double(xs)
+    ys <- as.double(ys)
+    x_range <- as.double(range(xs, finite = TRUE))
+    y_range <- as.double(range(ys, finite = TRUE))
+    name <- charToRaw(enc2utf8(paste(name, collapse = " ")))
+    write_frame_header(2L, 4 + length(name) + 4 * 4 + 8 * (length(xs) + length(ys) + 4))
+    writeBin(length(name), .response_con, size = 4, endian = "little")
+    writeBin(name, .response_con)
+    write_float64_block(xs)
+    write_float64_block(ys)
+    write_float64_block(x_range)
+    write_float64_block(y_range)
+    flush(.response_con)
+}}
+emit_text <- function(text) {{
+    if (length(text) > 0) write_text_frame(1L, paste0(text, "\n"))
+}}
+
+# runs one request, everything it prints, plots, warns about or fails with goes out as frames tagged with its id
+serve <- function(id, code, incremental) {{
+    protocol$request <- as.integer(id)
+    withCallingHandlers(
+        tryCatch(
+            if (incremental) run_script_incremental(code) else run_script(code),
+            error = function(e) write_text_frame(3L, conditionMessage(e))
+        ),
+        warning = function(w) {{
+            emit_text(paste("Warning:", conditionMessage(w)))
+            invokeRestart("muffleWarning")
+        }},
+        message = function(m) {{
+            write_text_frame(1L, conditionMessage(m))
+            invokeRestart("muffleMessage")
+        }}
+    )
+    write_frame_header(4L, 0)
+    flush(.response_con)
+    invisible(NULL)
+}}
+
+run_script <- function(code) {{
+    env <- new.env(parent = .helpers)
+    for (expr in parse(text = code, keep.source = FALSE)) {{
+        emit_text(capture.output(invisible(eval(expr, env))))
+    }}
+}}
 plot_line <- function(xs, ys, name = "") {{
-    cat("custom_line_plot\n")
-    print_comma_separated(xs)
-    print_comma_separated(ys)
-    print_comma_separated(range(xs))
-    print_comma_separated(range(ys))
-    cat(name, "\n")
+    if (!is.null(incremental_state$recorded)) {{
+        incremental_state$recorded[[length(incremental_state$recorded) + 1]] <- list(xs = xs, ys = ys, name = name)
+        return(invisible(NULL))
+    }}
+    emit_line_plot(xs, ys, name)
+}}
+plot_func <- function(func, xs, name = deparse(substitute(func)), adaptive = FALSE, max_points = 2000, vectorized = NA) {{
+    # a warning of func (like NaNs from sqrt) shows up once, not once per point or per refinement round
+    samples <- with_unique_warnings(
+        if (adaptive) adaptive_samples(func, xs, max_points, vectorized)
+        else list(xs = xs, ys = evaluate_func(func, xs, vectorized))
+    )
+    plot_line(samples$xs, samples$ys, name)
+}}
+
+# the value of expr, every distinct warning it raised is passed on once after it finished
+with_unique_warnings <- function(expr) {{
+    warnings <- character()
+    value <- withCallingHandlers(expr, warning = function(w) {{
+        warnings <<- c(warnings, conditionMessage(w))
+        invokeRestart("muffleWarning")
+    }})
+    for (text in unique(warnings)) warning(text, call. = FALSE)
+    value
+}}
+
+# func at every x: a single call func(xs) when func works on vectors, one call per x otherwise
+# vectorized = NA tries the single call and falls back when it fails or does not return one number per x
+# output and warnings of an attempt that is kept are passed on, those of a failed attempt are dropped
+evaluate_func <- function(func, xs, vectorized = NA) {{
+    if (isTRUE(vectorized)) return(as.vector(func(xs)))
+    if (is.na(vectorized)) {{
+        ys <- NULL
+        warnings <- character()
+        output <- capture.output(ys <- tryCatch(
+            withCallingHandlers(func(xs), warning = function(w) {{
+                warnings <<- c(warnings, conditionMessage(w))
+                invokeRestart("muffleWarning")
+            }}),
+            error = function(e) NULL
+        ))
+        if (is.numeric(ys) && length(ys) == length(xs)) {{
+            if (length(output) > 0) cat(output, sep = "\n")
+            for (text in unique(warnings)) warning(text, call. = FALSE)
+            return(structure(as.vector(ys), vectorized = TRUE))
+        }}
+    }}
+    structure(sapply(xs, function(x) func(x)), vectorized = FALSE)
+}}
+
+# plot_func(adaptive = TRUE): samples func over range(xs) with at most max_points points instead of at xs
+# starts from an even grid and keeps splitting the segments next to points that stray from the straight
+# line through their neighbours by more than tolerance (relative to the height of the curve),
+# the worst ones first, so bends and jumps get dense sampling and flat stretches stay coarse
+adaptive_samples <- function(func, xs, max_points, vectorized = NA, initial_points = 65, tolerance = 1e-3) {{
+    x_range <- range(xs[is.finite(xs)])
+    max_points <- max(3, max_points)
+    sample_xs <- seq(x_range[1], x_range[2], length.out = min(max(3, initial_points), max_points))
+    sample_ys <- evaluate_func(func, sample_xs, vectorized)
+    # whatever the first call found out is used for the rest
+    if (is.na(vectorized)) vectorized <- isTRUE(attr(sample_ys, "vectorized"))
+    sample_ys <- as.vector(sample_ys)
+    min_width <- diff(x_range) * 1e-9
+
+    while (length(sample_xs) < max_points) {{
+        n <- length(sample_xs)
+        finite_ys <- sample_ys[is.finite(sample_ys)]
+        height <- if (length(finite_ys) > 0) diff(range(finite_ys)) else 0
+        if (height == 0) height <- 1
+
+        # distance of every inner point from the line through its neighbours
+        left <- 1:(n - 2)
+        middle <- left + 1
+        right <- left + 2
+        position <- (sample_xs[middle] - sample_xs[left]) / (sample_xs[right] - sample_xs[left])
+        expected <- sample_ys[left] + position * (sample_ys[right] - sample_ys[left])
+        deviation <- abs(sample_ys[middle] - expected) / height
+        deviation[is.na(deviation)] <- 0
+
+        # a segment is as bad as the worse of its two end points
+        score <- pmax(c(0, deviation), c(deviation, 0))
+        # a segment from a finite to a non-finite value holds the edge of a gap (or a pole) and is always split,
+        # one without a finite end lies inside the gap and never is, it would only use up max_points
+        finite <- is.finite(sample_ys)
+        score[xor(finite[-n], finite[-1])] <- Inf
+        score[!finite[-n] & !finite[-1]] <- 0
+        score[diff(sample_xs) < min_width] <- 0
+        refine <- which(score > tolerance)
+        if (length(refine) == 0) break
+        refine <- head(refine[order(score[refine], decreasing = TRUE)], max_points - n)
+
+        new_xs <- (sample_xs[refine] + sample_xs[refine + 1]) / 2
+        new_ys <- as.vector(evaluate_func(func, new_xs, vectorized))
+        sorted <- order(c(sample_xs, new_xs))
+        sample_xs <- c(sample_xs, new_xs)[sorted]
+        sample_ys <- c(sample_ys, new_ys)[sorted]
+    }}
+    list(xs = sample_xs, ys = sample_ys)
 }}
-plot_func <- function(func, xs, name = deparse(substitute(func))) {{
-    ys <- sapply(xs, function(x) func(x))
-    plot_line(xs, ys, name)
+
+# incremental evaluation: the previous script of this R process is remembered statement by statement
+# (its deparsed text, the variables it assigns and the output it produced) together with the environment
+# it ran in. only statements that changed, or that touch a variable assigned by one that changed, run again,
+# together with every assignment of a variable that a re-run statement would otherwise read with the value
+# it had at the end of the previous run.
+# the others keep their variables in that environment and just replay their recorded output (warnings included)
+# (so a clean statement that draws random numbers keeps its previous draw)
+incremental_state <- new.env()
+incremental_state$env <- NULL
+incremental_state$texts <- character()
+incremental_state$writes <- list()
+incremental_state$outputs <- list()
+incremental_state$recorded <- NULL
+
+# these can read or write variables behind the back of the tracking, scripts using them always run in full
+opaque_names <- c("<<-", "assign", "rm", "remove", "eval", "evalq", "get", "get0", "mget", "exists",
+                  "source", "sys.source", "attach", "environment", "sys.frame", "parent.frame", "set.seed")
+
+assigned_names <- function(expr) {{
+    found <- character()
+    walk <- function(e) {{
+        if (!is.call(e)) return(invisible(NULL))
+        if (is.name(e[[1]])) {{
+            op <- as.character(e[[1]])
+            if (op == "function") return(invisible(NULL)) # assignments in there are local to the function
+            if (op %in% c("<-", "=") && length(e) == 3) {{
+                target <- e[[2]]
+                while (is.call(target)) target <- target[[2]] # names(x) <- ..., x[i] <- ...
+                if (is.name(target) || is.character(target)) found <<- c(found, as.character(target))
+            }}
+            if (op == "for") found <<- c(found, as.character(e[[2]]))
+        }}
+        for (i in seq_along(e)) {{
+            if (!identical(e[[i]], quote(expr = ))) walk(e[[i]])
+        }}
+    }}
+    walk(expr)
+    unique(found)
+}}
+
+emit_statement_output <- function(output) {{
+    emit_text(output$text)
+    for (plot in output$plots) emit_line_plot(plot$xs, plot$ys, plot$name)
+}}
+
+run_script_incremental <- function(code) {{
+    state <- incremental_state
+    on.exit(state$recorded <- NULL)
+
+    exprs <- as.list(parse(text = code, keep.source = FALSE))
+    n <- length(exprs)
+    texts <- vapply(exprs, function(e) paste(deparse(e), collapse = "\n"), "")
+    writes <- lapply(exprs, assigned_names)
+    reads <- lapply(exprs, all.names)
+    opaque <- any(unlist(reads) %in% opaque_names)
+
+    old_texts <- state$texts
+    dirty <- rep(TRUE, n)
+    env <- state$env
+    if (opaque || is.null(env)) {{
+        env <- new.env(parent = .helpers)
+    }} else {{
+        dirty <- vapply(seq_len(n), function(i) i > length(old_texts) || !identical(texts[[i]], old_texts[[i]]), TRUE)
+        gone <- vapply(seq_along(old_texts), function(i) i > n || !identical(texts[[i]], old_texts[[i]]), TRUE)
+        stale <- unique(c(unlist(writes[dirty]), unlist(state$writes[gone])))
+        # the environment holds the values left at the end of the previous run: a dirty statement reading
+        # a name that it or a later statement assigns would see the wrong value, so that name is recomputed
+        # from scratch by all of its writers (y <- 1; z <- y + slider(...); y <- 2)
+        overwritten <- function(i) intersect(reads[[i]], unlist(writes[seq(i, n)]))
+        repeat {{
+            stale <- unique(c(stale, unlist(lapply(which(dirty), overwritten))))
+            spread <- !dirty & vapply(seq_len(n), function(i) any(c(reads[[i]], writes[[i]]) %in% stale), TRUE)
+            if (!any(spread)) break
+            dirty <- dirty | spread
+            stale <- unique(c(stale, unlist(writes[spread])))
+        }}
+        rm(list = intersect(stale, ls(env, all.names = TRUE)), envir = env)
+    }}
+
+    # if this run fails half way the next one starts from scratch
+    state$env <- NULL
+    outputs <- vector("list", n)
+    for (i in seq_len(n)) {{
+        if (dirty[[i]]) {{
+            state$recorded <- list()
+            # warnings and messages go into the output in between what is printed, so a replay shows them too
+            text <- capture.output(invisible(withCallingHandlers(
+                eval(exprs[[i]], env),
+                warning = function(w) {{
+                    cat(paste0("Warning: ", conditionMessage(w), "\n"))
+                    invokeRestart("muffleWarning")
+                }},
+                message = function(m) {{
+                    cat(conditionMessage(m))
+                    invokeRestart("muffleMessage")
+                }}
+            )))
+            outputs[[i]] <- list(text = text, plots = state$recorded)
+            state$recorded <- NULL
+        }} else {{
+            outputs[[i]] <- state$outputs[[i]]
+        }}
+        emit_statement_output(outputs[[i]])
+    }}
+
+    if (!opaque) {{
+        state$env <- env
+        state$texts <- texts
+        state$writes <- writes
+        state$outputs <- outputs
+    }}
+    invisible(NULL)
 }}
 """
 
+# seconds a new R process gets to connect its response socket (see r_protocol)
+RESPONSE_CONNECT_TIMEOUT = 10
+
+# only re-run the statements of a script that are affected by what changed since the previous run
+INCREMENTAL_EVALUATION = True
+
+# wall clock seconds a single evaluation may take before its R process is killed and replaced
+EVALUATION_TIMEOUT = 20
+# address space limit of every R process (None for no limit), only where the resource module exists
+R_MEMORY_LIMIT_BYTES = 4 * 1024 * 1024 * 1024
+# warm R processes kept by r_runner, requests go to whichever one is idle
+R_POOL_SIZE = max(2, min(8, (os.cpu_count() or 1) - 1))
+# slider steps (relative to the one being dragged) that idle R processes evaluate ahead of time
+PREFETCH_OFFSETS = [1, -1, 2, -2]
+# speculative results kept around waiting to be picked up
+PREFETCH_LIMIT = 16
+# memory budget of the parsed results memoized by r_runner (least recently used ones are evicted)
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# results are also kept on disk across sessions, below the memory cache (0 turns it off)
+DISK_CACHE_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "r-graph-visualizer", "results.sqlite")
+DISK_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# limits for precomputing every slider step combination of a script
+SWEEP_MAX_SLIDERS = 2
+SWEEP_MAX_STEPS = 5000
+SWEEP_MAX_BYTES = 512 * 1024 * 1024
+ANIMATION_INTERVAL_MS = 40
+
+# series with more points than this are drawn without antialiasing
+ANTIALIASING_MAX_POINTS = 50000
+# sorted series longer than this are drawn from a min/max pyramid instead of every point
+DECIMATION_MIN_POINTS = 4096
+# points per bounding box in the spatial index of series that are not sorted by x
+CULLING_CHUNK_SIZE = 512
+# zoom factor per mouse wheel notch
+ZOOM_STEP = 1.25
+# slider moves are evaluated at most once per frame, editor edits once typing pauses for EDITOR_DEBOUNCE_MS
+# a slider move wins over an edit that is due at the same time
+SCHEDULER_FRAME_MS = 16
+EDITOR_DEBOUNCE_MS = 200
+SLIDER_PRIORITY = 1
+EDITOR_PRIORITY = 0
+# streamed plots are repainted at most once per interval
+REPAINT_INTERVAL_MS = 16
+# streamed text output is handed to the GUI in batches of this many lines
+STREAM_BATCH_LINES = 256
+
+# how many stage timings timing.RECORDER keeps for the overlay and the export
+TIMING_BUFFER_SIZE = 4096
+
+# default frame size of render.py
+RENDER_WIDTH = 1200
+RENDER_HEIGHT = 800
+# Qt's PNG quality setting, it trades file size for encoding time (which dominates the time per frame)
+RENDER_PNG_QUALITY = 80
+
+# parsed slider lines kept by sliders.parse_line
+SLIDER_PARSE_CACHE_SIZE = 1024
+
 SLIDER_REGEX_PATTERN = r'slider\(.*?\)'
 SLIDER_REGEX_CAPTURE_PATTERN = r'slider\(([^)]+)\)'
\ No newline at end of file
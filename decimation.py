@@ -0,0 +1,112 @@
+from array import array
+import math
+import operator
+
+# min/max decimation for series whose x values are sorted and whose points are all finite
+# (min / max of a pair holding NaN depend on the order of the pair, see all_finite)
+# level k of the pyramid summarizes every 2**k consecutive points in one bucket (x extent, first / min / max / last y)
+# a bucket is drawn as 4 points, so a level is only worth it from 3 up, and it is only used when no bucket
+# is wider than a pixel: inside one pixel column the 4 points cover the same pixels as the raw polyline
+
+
+# buckets smaller than this are not worth summarizing
+MIN_LEVEL = 3
+
+
+def is_sorted(xs):
+    return all(map(operator.le, xs, xs[1:]))
+
+# no NaN or infinity, the sum only stays finite without them (an overflowing sum takes the slow way)
+def all_finite(values):
+    return math.isfinite(sum(values)) or all(map(math.isfinite, values))
+
+
+# even and odd elements, an odd tail is paired with itself
+def _pairs(values):
+    if len(values) % 2:
+        values = values + values[-1:]
+    return values[0::2], values[1::2]
+
+
+class Level:
+    __slots__ = ('x_min', 'x_max', 'y_min', 'y_max', 'y_first', 'y_last', 'max_bucket_width')
+
+    def __init__(self, x_min, x_max, y_min, y_max, y_first, y_last):
+        self.x_min = x_min
+        self.x_max = x_max
+        self.y_min = y_min
+        self.y_max = y_max
+        self.y_first = y_first
+        self.y_last = y_last
+        self.max_bucket_width = max(map(operator.sub, x_max, x_min))
+
+    def __len__(self):
+        return len(self.x_min)
+
+    @staticmethod
+    def from_points(xs, ys):
+        x_left, x_right = _pairs(xs)
+        y_left, y_right = _pairs(ys)
+        return Level(
+            x_left, x_right,
+            array('d', map(min, y_left, y_right)), array('d', map(max, y_left, y_right)),
+            y_left, y_right,
+        )
+
+    def coarser(self):
+        x_min, _ = _pairs(self.x_min)
+        _, x_max = _pairs(self.x_max)
+        y_min_left, y_min_right = _pairs(self.y_min)
+        y_max_left, y_max_right = _pairs(self.y_max)
+        y_first, _ = _pairs(self.y_first)
+        _, y_last = _pairs(self.y_last)
+        return Level(
+            x_min, x_max,
+            array('d', map(min, y_min_left, y_min_right)), array('d', map(max, y_max_left, y_max_right)),
+            y_first, y_last,
+        )
+
+    # first, min, max, last of every bucket as one polyline
+    def points(self):
+        count = len(self)
+        xs = array('d', bytes(32 * count))
+        ys = array('d', bytes(32 * count))
+        xs[0::4] = self.x_min
+        xs[1::4] = self.x_min
+        xs[2::4] = self.x_max
+        xs[3::4] = self.x_max
+        ys[0::4] = self.y_first
+        ys[1::4] = self.y_min
+        ys[2::4] = self.y_max
+        ys[3::4] = self.y_last
+        return xs, ys
+
+
+class Pyramid:
+    def __init__(self, xs, ys):
+        count = min(len(xs), len(ys))
+        self._xs = xs[:count]
+        self._ys = ys[:count]
+        # levels[k - 1] is level k, built on demand from the one below it
+        self.levels = []
+
+    def _level(self, k):
+        while len(self.levels) < k:
+            if self.levels:
+                self.levels.append(self.levels[-1].coarser())
+            else:
+                self.levels.append(Level.from_points(self._xs, self._ys))
+        return self.levels[k - 1]
+
+    # coarsest level whose buckets all fit in pixel_width (in data units), 0 means draw the raw points
+    def level_for(self, pixel_width):
+        best = 0
+        k = 1
+        while (len(self._xs) >> k) >= 2:
+            level = self._level(k)
+            if level.max_bucket_width > pixel_width:
+                break
+            if k >= MIN_LEVEL:
+                best = k
+            k += 1
+        return best
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import r_protocol
+
+# parsed r_runner results kept in an SQLite file, so they survive a restart of the app
+# it sits below result_cache.Cache: memory misses are looked up here before R is asked
+# results are stored in the framed encoding of r_protocol.encode_result (plot data as raw float64)
+# keys are salted with the R version and the helper code, a result computed by another R never matches
+# least recently used results are deleted once the file holds more than max_bytes of results
+# any sqlite error (a locked or broken file, a full disk) just turns into a miss, so does a row that does not decode
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+"""
+
+
+class Cache:
+    def __init__(self, path, max_bytes, salt):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._salt = hashlib.sha256(salt.encode()).hexdigest()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # one connection shared by every thread, the lock keeps them from using it at the same time
+        # the timeout covers another instance of the app writing to the same file
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+        self._total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    # key is a result_cache.script_key
+    def disk_key(self, key):
+        return hashlib.sha256((self._salt + key).encode()).hexdigest()
+
+    def get(self, key):
+        disk_key = self.disk_key(key)
+        try:
+            with self._lock:
+                row = self._connection.execute("SELECT data FROM results WHERE key = ?", (disk_key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                with self._connection:
+                    self._connection.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), disk_key))
+                self.hits += 1
+        except sqlite3.Error:
+            return None
+        try:
+            return r_protocol.decode_result(row[0])
+        except (r_protocol.ProtocolError, TypeError):
+            # a damaged row is a miss, and it is deleted so the result gets computed and stored again
+            self.discard(disk_key)
+            return None
+
+    def put(self, key, result):
+        data = r_protocol.encode_result(result)
+        if len(data) > self.max_bytes:
+            return
+
+        disk_key = self.disk_key(key)
+        try:
+            with self._lock, self._connection:
+                old = self._connection.execute("SELECT size FROM results WHERE key = ?", (disk_key,)).fetchone()
+                if old is not None:
+                    self._total_bytes -= old[0]
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO results (key, data, size, used) VALUES (?, ?, ?, ?)",
+                    (disk_key, data, len(data), time.time())
+                )
+                self._total_bytes += len(data)
+                if self._total_bytes > self.max_bytes:
+                    self.evict()
+        except sqlite3.Error:
+            pass
+
+    def discard(self, disk_key):
+        try:
+            with self._lock, self._connection:
+                self.hits -= 1
+                self.misses += 1
+                old = self._connection.execute("SELECT size FROM results WHERE key = ?", (disk_key,)).fetchone()
+                if old is not None:
+                    self._total_bytes -= old[0]
+                    self._connection.execute("DELETE FROM results WHERE key = ?", (disk_key,))
+        except sqlite3.Error:
+            pass
+
+    # deletes the least recently used results until the rest fits, called with the lock held
+    def evict(self):
+        rows = self._connection.execute("SELECT key, size FROM results ORDER BY used").fetchall()
+        evicted = []
+        for disk_key, size in rows:
+            if self._total_bytes <= self.max_bytes:
+                break
+            evicted.append((disk_key,))
+            self._total_bytes -= size
+        self._connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+    def clear(self):
+        try:
+            with self._lock, self._connection:
+                self._connection.execute("DELETE FROM results")
+                self._total_bytes = 0
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'path': self.path,
+            }
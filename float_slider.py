@@ -30,23 +30,31 @@ QSlider::sub-page:horizontal {
 class Widget(QSlider):
     def __init__(self, min_val, max_val, step, default_val, value_label, name, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._min_val = min_val
-        self._step = step
         self._value_label = value_label
         self._name = name
+        self.setSingleStep(1)
+        self.setPageStep(1)
+        self.set_range(min_val, max_val, step, default_val)
+
+        self.setStyleSheet(SLIDER_CSS)
+
+
+    # also used to change the range of an existing slider, value is snapped into the new range
+    # no valueChanged is emitted, the caller knows the slider changed
+    def set_range(self, min_val, max_val, step, value):
+        self._min_val = min_val
+        self._step = step
 
         # Adjust max_val to align with the nearest step below the original max_val
         self._number_of_steps = math.floor((max_val - min_val) / step)
         self._max_val = min_val + self._number_of_steps * step
 
         # Set the slider's range to integer steps
+        blocked = self.blockSignals(True)
         super().setRange(0, self._number_of_steps)
-        self.setSingleStep(1)
-        self.setPageStep(1)
-        self.setValue(self._value_to_scaled(self._snap(default_val)))
-
-        self.setStyleSheet(SLIDER_CSS)
-
+        self.setValue(self._value_to_scaled(self._snap(value)))
+        self.blockSignals(blocked)
+        self._show_value()
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
@@ -65,14 +73,27 @@ class Widget(QSlider):
             if scaled_snapped != scaled_current:
                 self.setValue(scaled_snapped)
             
-            self._value_label.setText(f"{self._name}\n{snapped_value:.2f}")
+            self._show_value()
         
         super().sliderChange(change)
 
+    def _show_value(self):
+        self._value_label.setText(f"{self._name}\n{self.get_value():.2f}")
+
 
     def get_value(self):
         return self._scaled_to_value(self.value())
 
+    def get_all_values(self):
+        return [self._scaled_to_value(scaled) for scaled in range(self._number_of_steps + 1)]
+
+    # value that is `offset` steps away from the current one, None if that falls off the slider
+    def get_value_at_offset(self, offset):
+        scaled = self.value() + offset
+        if scaled < 0 or scaled > self._number_of_steps:
+            return None
+        return self._scaled_to_value(scaled)
+
 
     def _snap(self, value):
         return misc.snap(self._min_val, self._max_val, self._step, value)
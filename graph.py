@@ -1,9 +1,227 @@
-from PyQt6.QtCore import Qt, QPointF, QRect
-from PyQt6.QtGui import QPainter, QPen, QColor, QBrush, QFont
+from PyQt6.QtCore import Qt, QPointF, QRect, QRectF, QTimer
+from PyQt6.QtGui import QPainter, QPen, QColor, QBrush, QFont, QPixmap, QPolygonF, QTransform
 from PyQt6.QtWidgets import  QWidget, QSizePolicy
+from array import array
+import bisect
+import ctypes
+import hashlib
 import math
-
-import color_generator
+import time
+
+import color_generator, decimation, misc, timing
+from constants import ANTIALIASING_MAX_POINTS, DECIMATION_MIN_POINTS, CULLING_CHUNK_SIZE, ZOOM_STEP, REPAINT_INTERVAL_MS
+
+
+# copies the coordinates into a QPolygonF without creating a python object per point
+def polygon_from_arrays(xs, ys):
+    count = min(len(xs), len(ys))
+    polygon = QPolygonF()
+    if count == 0:
+        return polygon
+
+    interleaved = array('d', bytes(16 * count))
+    interleaved[0::2] = xs[:count]
+    interleaved[1::2] = ys[:count]
+
+    polygon.fill(QPointF(), count)
+    ctypes.memmove(int(polygon.data()), interleaved.buffer_info()[0], 16 * count)
+    return polygon
+
+
+# every segment of a polyline as its own pair of points, for QPainter.drawLines
+# stroking the segments one by one is a lot cheaper than one drawPolyline with a wide antialiased pen,
+# whose cost grows with the area the whole (zigzagging) outline covers
+def segment_pairs(polygon):
+    points = list(polygon)
+    if len(points) < 2:
+        return []
+    pairs = [None] * (2 * len(points) - 2)
+    pairs[0::2] = points[:-1]
+    pairs[1::2] = points[1:]
+    return pairs
+
+
+# (start, end) ranges of consecutive points whose x and y are both finite, drawing stops at NaN / infinity
+def finite_runs(xs, ys, count):
+    xs = xs[:count]
+    ys = ys[:count]
+    if decimation.all_finite(xs) and decimation.all_finite(ys):
+        return [(0, count)] if count else []
+
+    runs = []
+    start = None
+    for i, finite in enumerate(map(lambda x, y: math.isfinite(x) and math.isfinite(y), xs, ys)):
+        if finite and start is None:
+            start = i
+        elif not finite and start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, count))
+    return runs
+
+# bounding box of the points whose x and y are both finite, None if there are none
+def finite_bounds(xs, ys):
+    if not (decimation.all_finite(xs) and decimation.all_finite(ys)):
+        points = [(x, y) for x, y in zip(xs, ys) if math.isfinite(x) and math.isfinite(y)]
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+    if not xs:
+        return None
+    return QRectF(QPointF(min(xs), min(ys)), QPointF(max(xs), max(ys)))
+
+# the parts of the (sorted, disjoint) ranges a that are also in b
+def intersect_runs(a, b):
+    runs = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start < end:
+            runs.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return runs
+
+
+# unlike QRectF.intersects this also works for zero width / height rectangles (flat or vertical series)
+def rects_overlap(a, b):
+    return a.left() <= b.right() and b.left() <= a.right() and a.top() <= b.bottom() and b.top() <= a.bottom()
+
+
+# identifies the points of a series, see Widget.add_line_data
+def content_digest(xs, ys):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(memoryview(xs).cast('B'))
+    digest.update(memoryview(ys).cast('B'))
+    return digest.digest()
+
+
+class Dataset:
+    __slots__ = (
+        'xs', 'ys', 'color', 'name', 'polygon', 'finite_runs', '_digest',
+        '_screen_key', '_screen_polygons', '_pyramid', '_level_polygons', '_sorted', '_bounds', '_chunks',
+    )
+
+    def __init__(self, xs, ys, color, name):
+        self.xs = xs if isinstance(xs, array) else array('d', xs)
+        self.ys = ys if isinstance(ys, array) else array('d', ys)
+        self.color = color
+        self.name = name
+        # data space points, mapped to the screen in one go by screen_polygons
+        self.polygon = polygon_from_arrays(self.xs, self.ys)
+        # Qt draws garbage for NaN coordinates, only these point ranges are ever drawn
+        self.finite_runs = finite_runs(self.xs, self.ys, self.polygon.size())
+        self._digest = None
+        self._screen_key = None
+        self._screen_polygons = None
+        # decimation.Pyramid, built on first use, False if this series cannot be decimated
+        self._pyramid = None
+        self._level_polygons = {}
+        # spatial index, all built on first use
+        self._sorted = None
+        self._bounds = None
+        self._chunks = None
+
+    def digest(self):
+        if self._digest is None:
+            self._digest = content_digest(self.xs, self.ys)
+        return self._digest
+
+    # same points as the given arrays (arrays that are the very same objects are not hashed)
+    def has_points(self, xs, ys):
+        return (xs is self.xs and ys is self.ys) or content_digest(xs, ys) == self.digest()
+
+    def is_sorted(self):
+        if self._sorted is None:
+            self._sorted = decimation.is_sorted(self.xs[:self.polygon.size()])
+        return self._sorted
+
+    def bounds(self):
+        if self._bounds is None:
+            count = self.polygon.size()
+            self._bounds = finite_bounds(self.xs[:count], self.ys[:count]) or QRectF()
+        return self._bounds
+
+    # bounding boxes of consecutive runs of points, for series that are not sorted by x
+    # a chunk shares its last point with the next one so the segment between them is covered too
+    # bounds only cover finite points, a chunk without any is left out
+    def chunks(self):
+        if self._chunks is None:
+            self._chunks = []
+            count = self.polygon.size()
+            for start in range(0, max(count - 1, 1), CULLING_CHUNK_SIZE):
+                end = min(start + CULLING_CHUNK_SIZE + 1, count)
+                chunk_bounds = finite_bounds(self.xs[start:end], self.ys[start:end])
+                if chunk_bounds is not None:
+                    self._chunks.append((start, end, chunk_bounds))
+        return self._chunks
+
+    # pyramid level and data space polygon to draw when a pixel is pixel_width wide in data units
+    # series with non-finite points are never decimated
+    def level_polygon(self, pixel_width):
+        if self._pyramid is None:
+            count = self.polygon.size()
+            if count > DECIMATION_MIN_POINTS and self.is_sorted() and decimation.all_finite(self.xs[:count]) and decimation.all_finite(self.ys[:count]):
+                self._pyramid = decimation.Pyramid(self.xs, self.ys)
+            else:
+                self._pyramid = False
+        if not self._pyramid:
+            return 0, self.polygon
+
+        level = self._pyramid.level_for(pixel_width)
+        if level == 0:
+            return 0, self.polygon
+        polygon = self._level_polygons.get(level)
+        if polygon is None:
+            polygon = polygon_from_arrays(*self._pyramid.levels[level - 1].points())
+            self._level_polygons[level] = polygon
+        return level, polygon
+
+    # (start, end) point ranges of the level's polygon that can reach into view (a data space QRectF)
+    def visible_runs(self, level, polygon, view):
+        count = polygon.size()
+        bounds = self.bounds()
+        if not rects_overlap(view, bounds):
+            return []
+        if view.contains(bounds):
+            return [(0, count)]
+
+        if self.is_sorted():
+            # one point past each edge so the segments leaving the view are drawn
+            index = self.xs if level == 0 else self._pyramid.levels[level - 1].x_min
+            points_per_entry = 1 if level == 0 else 4
+            start = max(0, bisect.bisect_left(index, view.left()) - 1)
+            end = min(count // points_per_entry, bisect.bisect_right(index, view.right()) + 1)
+            return [(start * points_per_entry, end * points_per_entry)] if start < end else []
+
+        runs = []
+        for start, end, chunk_bounds in self.chunks():
+            if not rects_overlap(view, chunk_bounds):
+                continue
+            if runs and runs[-1][1] > start:
+                runs[-1] = (runs[-1][0], end)
+            else:
+                runs.append((start, end))
+        return runs
+
+    # screen space polygons of the parts of this series inside view, pixel_width=None draws every point
+    # decimated levels only exist for series without non-finite points (see level_polygon)
+    def screen_polygons(self, transform, view, pixel_width=None):
+        level, polygon = (0, self.polygon) if pixel_width is None else self.level_polygon(pixel_width)
+        runs = self.visible_runs(level, polygon, view)
+        if level == 0 and self.finite_runs != [(0, polygon.size())]:
+            runs = intersect_runs(runs, self.finite_runs)
+        key = (level, tuple(runs), transform.m11(), transform.m22(), transform.dx(), transform.dy())
+        if key != self._screen_key:
+            self._screen_polygons = [
+                transform.map(polygon if (start, end) == (0, polygon.size()) else polygon.mid(start, end - start))
+                for start, end in runs
+            ]
+            self._screen_key = key
+        return self._screen_polygons
 
 class Widget(QWidget):
     def __init__(self):
@@ -14,8 +232,30 @@ class Widget(QWidget):
         self.y_abs_max = 1
         self.colors = [QColor(0, 0, 255), QColor(255, 0, 0), QColor(0, 255, 0), QColor(255, 165, 0), QColor(128, 0, 128), QColor(0, 255, 255)]
         self.current_color_index = 0
+        # (call order, name) -> dataset of the previous update, see begin_update
+        self._previous = {}
+        self._previous_maxima = (1, 1)
         self.one_to_one_scaling = False
         self.draw_points = False
+        self.show_timing_overlay = False
+        # offscreen layers for everything that does not move with the data, see axes_layer / legend_layer
+        self._axes_layer = None
+        self._axes_layer_key = None
+        self._legend_layer = None
+        self._legend_layer_key = None
+        # view on top of the fitted box: zoom factor and the data point shown in the middle of the widget
+        self.view_zoom = 1.0
+        self.view_center = QPointF(0, 0)
+        self._drag_position = None
+        # data changes arrive one plot at a time while R is streaming, they share one repaint per interval
+        self._repaint_timer = QTimer(self)
+        self._repaint_timer.setSingleShot(True)
+        self._repaint_timer.setInterval(REPAINT_INTERVAL_MS)
+        self._repaint_timer.timeout.connect(self.update)
+
+    def schedule_repaint(self):
+        if not self._repaint_timer.isActive():
+            self._repaint_timer.start()
 
     def toggle_scaling(self):
         self.one_to_one_scaling = not self.one_to_one_scaling
@@ -25,51 +265,85 @@ class Widget(QWidget):
         self.draw_points = not self.draw_points
         self.update()
 
+    def toggle_timing_overlay(self):
+        self.show_timing_overlay = not self.show_timing_overlay
+        self.update()
+
+    def reset_view(self):
+        self.view_zoom = 1.0
+        self.view_center = QPointF(0, 0)
+        self.update()
+
 
     def clear(self):
+        self.datasets = []
+        self._previous = {}
+        self.x_abs_max = 1
+        self.y_abs_max = 1
+        self.current_color_index = 0
+        self.schedule_repaint()
+
+    # replacing every dataset with a new result: begin_update, add_line_data for each plot, finish_update
+    # a dataset is known by its call order and name, one that comes back with the same points keeps its
+    # buffers, decimation and cached screen polygons, and nothing is repainted unless something changed
+    def begin_update(self):
+        self._previous = {(index, dataset.name): dataset for index, dataset in enumerate(self.datasets)}
+        self._previous_maxima = (self.x_abs_max, self.y_abs_max)
         self.datasets = []
         self.x_abs_max = 1
         self.y_abs_max = 1
         self.current_color_index = 0
-        self.update()
-        color_generator.reset()
+
+    # datasets of the previous update that did not come back are dropped
+    def finish_update(self):
+        if self._previous or (self.x_abs_max, self.y_abs_max) != self._previous_maxima:
+            self.schedule_repaint()
+        self._previous = {}
+        self._previous_maxima = (self.x_abs_max, self.y_abs_max)
 
     def add_line_data(self, xs, ys, xmi, xmx, ymi, ymx, name):
-        points = list(zip(xs, ys)) if (xs and ys) else []
-        
+        with timing.measure(timing.ADD_LINE_DATA):
+            self.add_dataset(xs, ys, xmi, xmx, ymi, ymx, name)
+
+    def add_dataset(self, xs, ys, xmi, xmx, ymi, ymx, name):
         # Calculate max values with padding
         x_abs_max_candidate = max(abs(xmi), abs(xmx)) * 1.1 or 1
         y_abs_max_candidate = max(abs(ymi), abs(ymx)) * 1.1 or 1
+        # a series without finite values (an empty one has the range (Inf, -Inf)) does not widen the axes
+        if not math.isfinite(x_abs_max_candidate):
+            x_abs_max_candidate = 1
+        if not math.isfinite(y_abs_max_candidate):
+            y_abs_max_candidate = 1
         
         # Update widget's absolute maxima
         self.x_abs_max = max(self.x_abs_max, x_abs_max_candidate)
         self.y_abs_max = max(self.y_abs_max, y_abs_max_candidate)
-        
-        # Assign color and store dataset
-        color = 'UNDEFINED'
-        if self.current_color_index < len(self.colors):
-            color = self.colors[self.current_color_index]
+
+        xs = xs if isinstance(xs, array) else array('d', xs)
+        ys = ys if isinstance(ys, array) else array('d', ys)
+        previous = self._previous.pop((self.current_color_index, name), None)
+        if previous is not None and previous.has_points(xs, ys):
+            dataset = previous
         else:
-            color = color_generator.next()
-        
-        self.datasets.append({
-            'points': points,
-            'color': color,
-            'name': name
-        })
+            dataset = Dataset(xs, ys, self.color_at(self.current_color_index), name)
+        self.datasets.append(dataset)
         self.current_color_index += 1
-        self.update()
 
+        previous_x_abs_max, previous_y_abs_max = self._previous_maxima
+        if dataset is not previous or self.x_abs_max > previous_x_abs_max or self.y_abs_max > previous_y_abs_max:
+            self.schedule_repaint()
+
+    # the n-th curve always gets the same color
+    def color_at(self, index):
+        if index < len(self.colors):
+            return self.colors[index]
+        return color_generator.color(index - len(self.colors))
 
 
-    def paintEvent(self, event):
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
+    def view_scales(self):
         # Calculate dimensions
         margin = int(min(self.width(), self.height()) * 0.1)
-        center_x = self.width() / 2
-        center_y = self.height() / 2
         available_width = self.width() - 2 * margin
         available_height = self.height() - 2 * margin
 
@@ -82,32 +356,166 @@ class Widget(QWidget):
             x_scale = scale
             y_scale = scale
 
-        # Draw elements
-        self.draw_axes(painter, center_x, center_y, 0)
-        self.draw_ticks(painter, center_x, center_y, x_scale, y_scale)
-        self.draw_graphs(painter, center_x, center_y, x_scale, y_scale)
-        self.draw_legend(painter)
+        return x_scale * self.view_zoom, y_scale * self.view_zoom
+
+    # data space -> widget coordinates
+    def view_transform(self):
+        x_scale, y_scale = self.view_scales()
+        center_x = self.width() / 2
+        center_y = self.height() / 2
+        return QTransform(
+            x_scale, 0, 0, -y_scale,
+            center_x - self.view_center.x() * x_scale,
+            center_y + self.view_center.y() * y_scale
+        )
+
+    def paintEvent(self, event):
+        self.paint(QPainter(self))
+
+    # draws the graph onto any paint device of the widget's size (render.py uses it without a window)
+    # vector devices (like QSvgGenerator) get the axes and legend drawn directly instead of as cached pixmaps
+    # the timing overlay is drawn last and not counted in the paint stage
+    def paint(self, painter, vector=False):
+        start = time.perf_counter()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setFont(self.font())
+
+        transform = self.view_transform()
+
+        if vector:
+            self.draw_axes_and_ticks(painter, transform)
+            points_drawn = self.draw_graphs(painter, transform)
+            self.draw_legend(painter)
+        else:
+            # Draw elements, axes and legend come from cached layers so data-only repaints stay cheap
+            painter.drawPixmap(0, 0, self.axes_layer(transform))
+            points_drawn = self.draw_graphs(painter, transform)
+            painter.drawPixmap(0, 0, self.legend_layer())
+
+        timing.RECORDER.record(timing.PAINT, start, time.perf_counter() - start)
+        timing.RECORDER.set(timing.POINTS_DRAWN, points_drawn)
+        if self.show_timing_overlay and not vector:
+            self.draw_timing_overlay(painter)
+
+
+
+    # zooms around the cursor, the data point under it stays in place
+    def wheelEvent(self, event):
+        position = event.position()
+        anchor = self.view_transform().inverted()[0].map(position)
+
+        self.view_zoom *= ZOOM_STEP ** (event.angleDelta().y() / 120)
+        x_scale, y_scale = self.view_scales()
+        self.view_center = QPointF(
+            anchor.x() - (position.x() - self.width() / 2) / x_scale,
+            anchor.y() + (position.y() - self.height() / 2) / y_scale
+        )
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self._drag_position = event.position()
+
+    def mouseMoveEvent(self, event):
+        if self._drag_position is None:
+            return
+        delta = event.position() - self._drag_position
+        self._drag_position = event.position()
+
+        x_scale, y_scale = self.view_scales()
+        self.view_center = QPointF(self.view_center.x() - delta.x() / x_scale, self.view_center.y() + delta.y() / y_scale)
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self._drag_position = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.reset_view()
+
+
+
+    def new_layer(self):
+        dpr = self.devicePixelRatioF()
+        pixmap = QPixmap(max(1, round(self.width() * dpr)), max(1, round(self.height() * dpr)))
+        pixmap.setDevicePixelRatio(dpr)
+        pixmap.fill(Qt.GlobalColor.transparent)
+        return pixmap
+
+    def layer_painter(self, pixmap):
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setFont(self.font())
+        return painter
+
+    def axes_layer(self, transform):
+        key = (
+            self.size(), self.devicePixelRatioF(), self.one_to_one_scaling, self.x_abs_max, self.y_abs_max,
+            transform.m11(), transform.m22(), transform.dx(), transform.dy()
+        )
+        if key != self._axes_layer_key:
+            self._axes_layer = self.new_layer()
+            painter = self.layer_painter(self._axes_layer)
+            self.draw_axes_and_ticks(painter, transform)
+            painter.end()
+            self._axes_layer_key = key
+        return self._axes_layer
+
+    def legend_layer(self):
+        key = (self.size(), self.devicePixelRatioF(), [(d.name, d.color.rgba()) for d in self.datasets])
+        if key != self._legend_layer_key:
+            self._legend_layer = self.new_layer()
+            painter = self.layer_painter(self._legend_layer)
+            self.draw_legend(painter)
+            painter.end()
+            self._legend_layer_key = key
+        return self._legend_layer
     
 
 
-    def draw_graphs(self, painter, center_x, center_y, x_scale, y_scale):
+    def draw_axes_and_ticks(self, painter, transform):
+        # when the origin is panned out of view the axes stick to the closest edge, leaving room for the labels
+        axis_x = misc.clamp(0, max(0, self.width() - 60), transform.dx())
+        axis_y = misc.clamp(0, max(0, self.height() - 40), transform.dy())
+        self.draw_axes(painter, axis_x, axis_y, 0)
+        self.draw_ticks(painter, transform, axis_x, axis_y)
+
+
+
+    # returns how many points were handed to the painter
+    def draw_graphs(self, painter, transform):
+        x_scale = transform.m11()
+        # lines can be decimated down to a few points per (device) pixel column, single points can not
+        pixel_width = None
+        if not self.draw_points and x_scale > 0:
+            pixel_width = 1 / (x_scale * self.devicePixelRatioF())
+
+        # visible part of the data space, padded by the pen width
+        pad = 3
+        inverse, invertible = transform.inverted()
+        if not invertible:
+            return 0
+        view = inverse.mapRect(QRectF(-pad, -pad, self.width() + 2 * pad, self.height() + 2 * pad))
+
+        points_drawn = 0
         for dataset in self.datasets:
-            points = dataset['points']
-            color = dataset['color']
-            if not points:
+            if dataset.polygon.isEmpty():
                 continue
-            pen = QPen(color, 3)
+            pen = QPen(dataset.color, 3)
             painter.setPen(pen)
             
-            path = [QPointF(center_x + x * x_scale, center_y - y * y_scale) 
-                   for x, y in points]
+            paths = dataset.screen_polygons(transform, view, pixel_width)
+            # antialiasing a huge series costs a lot and is barely visible
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing, dataset.polygon.size() <= ANTIALIASING_MAX_POINTS)
             
-            if self.draw_points:
-                for point in path:
-                    painter.drawPoint(point)
-            else:
-                for i in range(1, len(path)):
-                    painter.drawLine(path[i-1], path[i])
+            for path in paths:
+                if self.draw_points:
+                    painter.drawPoints(path)
+                else:
+                    painter.drawLines(segment_pairs(path))
+                points_drawn += path.size()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        return points_drawn
             
 
 
@@ -129,7 +537,7 @@ class Widget(QWidget):
         text_padding = 5
 
         # Calculate legend dimensions
-        max_text_width = max(metrics.horizontalAdvance(d['name']) for d in self.datasets)
+        max_text_width = max(metrics.horizontalAdvance(d.name) for d in self.datasets)
         legend_width = swatch_size + text_padding + max_text_width + 10
         legend_height = line_height * len(self.datasets)
         
@@ -145,11 +553,11 @@ class Widget(QWidget):
         y_pos = rect.top() + 5
         for dataset in self.datasets:
             # Color swatch
-            painter.fillRect(rect.left() + 5, y_pos, swatch_size, swatch_size, dataset['color'])
+            painter.fillRect(rect.left() + 5, y_pos, swatch_size, swatch_size, dataset.color)
 
             # Text
             text_x = rect.left() + 5 + swatch_size + text_padding
-            painter.drawText(text_x, y_pos + metrics.ascent(), dataset['name'])
+            painter.drawText(text_x, y_pos + metrics.ascent(), dataset.name)
             
             y_pos += line_height
 
@@ -158,6 +566,40 @@ class Widget(QWidget):
 
 
 
+    # p50 / p95 of every pipeline stage over the timing ring buffer, in the top right corner
+    def draw_timing_overlay(self, painter):
+        summary = timing.RECORDER.summary()
+        lines = ["stage            p50 ms   p95 ms"]
+        for stage in timing.STAGES:
+            if stage in summary:
+                _, p50, p95 = summary[stage]
+                lines.append(f"{stage:<15}{p50 * 1000:8.2f} {p95 * 1000:8.2f}")
+        for counter in (timing.POINTS_DRAWN, timing.FRAMES_DROPPED):
+            lines.append(f"{counter:<15}{timing.RECORDER.counters.get(counter, 0):>17}")
+
+        original_font = painter.font()
+        overlay_font = QFont("monospace")
+        overlay_font.setStyleHint(QFont.StyleHint.Monospace)
+        overlay_font.setPointSize(8)
+        painter.setFont(overlay_font)
+
+        metrics = painter.fontMetrics()
+        margin = 10
+        padding = 5
+        width = max(metrics.horizontalAdvance(line) for line in lines) + 2 * padding
+        height = metrics.lineSpacing() * len(lines) + 2 * padding
+        rect = QRect(self.width() - width - margin, margin, width, height)
+
+        painter.setBrush(QBrush(QColor(255, 255, 255, 220)))
+        painter.setPen(QPen(Qt.GlobalColor.black, 1))
+        painter.drawRect(rect)
+        y_pos = rect.top() + padding + metrics.ascent()
+        for line in lines:
+            painter.drawText(rect.left() + padding, y_pos, line)
+            y_pos += metrics.lineSpacing()
+
+        painter.setFont(original_font)
+
     def draw_axes(self, painter, center_x, center_y, margin):
         pen = QPen(QColor(0, 0, 0), 2)
         painter.setPen(pen)
@@ -168,7 +610,8 @@ class Widget(QWidget):
 
 
 
-    def calculate_ticks(self, max_val):
+    # ticks covering center +- max_val
+    def calculate_ticks(self, max_val, center=0):
         if max_val <= 0:
             return []
         
@@ -186,55 +629,54 @@ class Widget(QWidget):
         else:
             step = 5 * factor
 
-        # Adjust max_val to the nearest multiple of step that is >= max_val
-        num_steps = math.ceil(max_val / step)
-        actual_max = num_steps * step
+        # Extend the range to the nearest multiples of step around it
+        first_step = math.floor((center - max_val) / step)
+        last_step = math.ceil((center + max_val) / step)
 
-        # Generate symmetric ticks
         ticks = []
-        for i in range(-num_steps, num_steps + 1):
+        for i in range(first_step, last_step + 1):
             tick = i * step
             ticks.append(tick)
         
         return ticks
 
-    def draw_ticks(self, painter, center_x, center_y, x_scale, y_scale):
+    def format_tick(self, tick, step):
+        if abs(tick) < 1e4:
+            # enough decimals to tell ticks apart when zoomed in
+            decimals = max(2, -math.floor(math.log10(step)))
+            return f"{tick:.{decimals}f}".rstrip('0').rstrip('.')
+        return f"{tick:.1e}"
+
+    def draw_ticks(self, painter, transform, axis_x, axis_y):
         pen = QPen(QColor(0, 0, 0), 1)
         painter.setPen(pen)
         metrics = painter.fontMetrics()
         tick_length = 5
 
         # X-axis ticks
-        x_ticks = self.calculate_ticks(self.x_abs_max)
+        x_ticks = self.calculate_ticks(self.x_abs_max / self.view_zoom, self.view_center.x())
+        x_step = x_ticks[1] - x_ticks[0] if len(x_ticks) > 1 else 1
         for tick in x_ticks:
-            x_pos = int(center_x + tick * x_scale)
-            painter.drawLine(x_pos, int(center_y - tick_length), x_pos, int(center_y + tick_length))
+            x_pos = int(transform.dx() + tick * transform.m11())
+            painter.drawLine(x_pos, int(axis_y - tick_length), x_pos, int(axis_y + tick_length))
             # Format label
-            if abs(tick) < 1e-4:
-                label = "0"
+            if abs(tick) < x_step / 2:
                 continue # do not draw 0 on the x axis
-            elif abs(tick) < 1e4:
-                label = f"{tick:.2f}".rstrip('0').rstrip('.')
-            else:
-                label = f"{tick:.1e}"
+            label = self.format_tick(tick, x_step)
             rect = metrics.boundingRect(label)
-            painter.drawText(x_pos - rect.width()//2, int(center_y + 20 + rect.height()), label)
+            painter.drawText(x_pos - rect.width()//2, int(axis_y + 20 + rect.height()), label)
 
         # Y-axis ticks
-        y_ticks = self.calculate_ticks(self.y_abs_max)
+        y_ticks = self.calculate_ticks(self.y_abs_max / self.view_zoom, self.view_center.y())
+        y_step = y_ticks[1] - y_ticks[0] if len(y_ticks) > 1 else 1
         for tick in y_ticks:
-            y_pos = int(center_y - tick * y_scale)
-            painter.drawLine(int(center_x - tick_length), y_pos, int(center_x + tick_length), y_pos)
+            y_pos = int(transform.dy() + tick * transform.m22())
+            painter.drawLine(int(axis_x - tick_length), y_pos, int(axis_x + tick_length), y_pos)
             # Format label
-            if abs(tick) < 1e-4:
+            if abs(tick) < y_step / 2:
                 label = "0"
                 y_pos += 10
-            elif abs(tick) < 1e4:
-                label = f"{tick:.2f}".rstrip('0').rstrip('.')
             else:
-                label = f"{tick:.1e}"
+                label = self.format_tick(tick, y_step)
             rect = metrics.boundingRect(label)
-            painter.drawText(int(center_x + 10), y_pos + rect.height()//2, label)
-
-
-
+            painter.drawText(int(axis_x + 10), y_pos + rect.height()//2, label)
@@ -8,7 +8,10 @@ if __name__ == "__main__":
     # needed for CTRL+C to work with pyqt6
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    r_runner.spawn_R_PROCESS()
+    try:
+        r_runner.spawn_R_POOL()
+    except (OSError, r_runner.RScriptError) as e:
+        sys.exit(app.show_startup_error(sys.argv, e))
     
     app.init(sys.argv)
     exit_code = app.run()
@@ -0,0 +1,317 @@
+from PyQt6.QtCore import QObject, pyqtSignal
+import asyncio
+import itertools
+import threading
+
+from constants import R_POOL_SIZE, EVALUATION_TIMEOUT, RESPONSE_CONNECT_TIMEOUT
+import r_protocol, r_runner, r_syntax, result_cache
+from r_runner import RScriptError, RSyntaxError, RTimeoutError, RProcessDiedError
+
+
+# asyncio counterpart of r_runner.RProcess, speaking the same r_protocol frames
+# one reader task per process hands every frame to the queue of its request, so requests can be pipelined
+class AsyncRProcess:
+    def __init__(self, timeout=EVALUATION_TIMEOUT):
+        self.process = None
+        # the caller enforces the timeout, it is only here for the error message
+        self.timeout = timeout
+        self.timed_out = False
+        self._reader = None
+        self._writer = None
+        # the r_protocol.ProtocolError that made the reader give up on the process
+        self.protocol_error = None
+        self._request_ids = itertools.count(1)
+        # request id -> asyncio.Queue of (channel, payload), (None, None) once the process is gone
+        self._pending = {}
+        self._tasks = []
+
+    async def spawn(self):
+        connected = asyncio.get_running_loop().create_future()
+        def accept(reader, writer):
+            if not connected.done():
+                connected.set_result((reader, writer))
+        server = await asyncio.start_server(accept, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        self.process = await asyncio.create_subprocess_exec(
+            *r_runner.R_COMMAND,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        r_runner.limit_memory(self.process.pid)
+        self.process.stdin.write(r_runner.response_channel_script(port).encode())
+        try:
+            self._reader, self._writer = await asyncio.wait_for(connected, RESPONSE_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.kill()
+            raise RProcessDiedError("R did not connect its response channel")
+        finally:
+            server.close()
+
+        self.process.stdin.write(r_runner.helpers_script().encode())
+        await self.process.stdin.drain()
+        self._tasks = [asyncio.create_task(self._read_frames()), asyncio.create_task(self._log_stray_output())]
+
+    def is_alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    def kill(self):
+        if self.is_alive():
+            self.process.kill()
+
+    async def close(self):
+        self.kill()
+        await self.process.wait()
+        if self._writer is not None:
+            self._writer.close()
+        for task in self._tasks:
+            task.cancel()
+
+    async def death_error(self):
+        code = await self.process.wait()
+        if self.protocol_error is not None:
+            return RProcessDiedError(f"unreadable response from R ({self.protocol_error}), R was restarted")
+        if self.timed_out:
+            return RTimeoutError(f"the script ran longer than {self.timeout} seconds and was stopped")
+        if code < 0:
+            return RProcessDiedError(f"R was killed by signal {-code}")
+        return RProcessDiedError(f"R exited with code {code}")
+
+
+    async def _read_frames(self):
+        try:
+            while True:
+                request_id, kind, payload = await r_protocol.read_frame_async(self._reader)
+                queue = self._pending.get(request_id)
+                if queue is not None:
+                    queue.put_nowait((kind, payload))
+        except r_protocol.ProtocolError as e:
+            self.give_up(e)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for queue in self._pending.values():
+                queue.put_nowait((None, None))
+
+    # the channel is out of step after a frame that does not decode, every waiting request fails
+    def give_up(self, error):
+        self.protocol_error = error
+        self.kill()
+        for queue in self._pending.values():
+            queue.put_nowait((None, None))
+
+    async def _log_stray_output(self):
+        async for line in self.process.stdout:
+            print(f"R: {line.decode(errors='replace').rstrip()}")
+
+
+    # sends a script without waiting for it, several can be in flight on one process
+    async def submit(self, script):
+        request_id = next(self._request_ids)
+        self._pending[request_id] = asyncio.Queue()
+        try:
+            self.process.stdin.write(r_runner.serve_call(request_id, script).encode())
+            await self.process.stdin.drain()
+        except ConnectionError:
+            self._pending.pop(request_id)
+            raise await self.death_error()
+        return request_id
+
+    # the whole output of a submitted script, in the format of r_runner.RProcess.run
+    async def results(self, request_id):
+        queue = self._pending[request_id]
+        if not self.is_alive():
+            queue.put_nowait((None, None))
+        output = []
+        error = None
+        try:
+            while True:
+                kind, payload = await queue.get()
+                if kind is None:
+                    raise await self.death_error()
+                if kind == r_protocol.END:
+                    break
+                if kind == r_protocol.ERROR:
+                    error = r_protocol.decode_text(payload)
+                else:
+                    try:
+                        output.extend(r_protocol.decode_entries(kind, payload))
+                    except r_protocol.ProtocolError as e:
+                        self.give_up(e)
+                        raise await self.death_error()
+        finally:
+            self._pending.pop(request_id, None)
+
+        if error is not None:
+            raise RScriptError(error.strip())
+        return output
+
+
+
+# a set of warm R processes driven by asyncio, without a thread per process
+# at most `limit` scripts are evaluated at once (one per process by default), the rest wait their turn
+# a cancelled run leaves its script running, the process is only reused once that output has been read
+# usage:
+#     session = AsyncRSession()
+#     await session.start()
+#     result = await session.run(script)   # raises r_runner.RScriptError (or a subclass) if the script failed
+#     await session.close()
+class AsyncRSession:
+    def __init__(self, size=R_POOL_SIZE, limit=None, cache=None, timeout=EVALUATION_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._cache = cache
+        self._limit = asyncio.Semaphore(limit or size)
+        self._idle = asyncio.Queue()
+        self._processes = []
+        self._background = set()
+
+    async def start(self):
+        self._processes = list(await asyncio.gather(*(self._spawn() for _ in range(self.size))))
+        for process in self._processes:
+            self._idle.put_nowait(process)
+
+    async def close(self):
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*(process.close() for process in self._processes), return_exceptions=True)
+        self._processes = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+    async def run(self, script):
+        syntax_error = r_syntax.check(script)
+        if syntax_error is not None:
+            raise RSyntaxError(syntax_error)
+
+        key = result_cache.script_key(script)
+        if self._cache is not None:
+            result = self._cache.get(key)
+            if result is not None:
+                return result
+
+        async with self._limit:
+            process = await self._idle.get()
+            try:
+                results = asyncio.ensure_future(process.results(await process.submit(script)))
+            except BaseException:
+                self._recycle(process)
+                raise
+
+            try:
+                result = await asyncio.wait_for(asyncio.shield(results), self.timeout)
+            except asyncio.TimeoutError:
+                process.timed_out = True
+                process.kill()
+                await asyncio.gather(results, return_exceptions=True)
+                self._recycle(process)
+                raise await process.death_error()
+            except asyncio.CancelledError:
+                self._detach(self._finish_cancelled(process, results))
+                raise
+            except BaseException:
+                self._recycle(process)
+                raise
+
+        self._recycle(process)
+        if self._cache is not None:
+            self._cache.put(key, result)
+        return result
+
+    # runs the scripts concurrently (within the limit), failed ones give their exception instead of a result
+    async def run_many(self, scripts):
+        return await asyncio.gather(*(self.run(script) for script in scripts), return_exceptions=True)
+
+
+    async def _spawn(self):
+        process = AsyncRProcess(self.timeout)
+        await process.spawn()
+        await process.results(await process.submit(""))
+        return process
+
+    # a dead process is replaced in the background, the waiting runs get the new one once it is up
+    def _recycle(self, process):
+        if process.is_alive():
+            self._idle.put_nowait(process)
+            return
+        self._detach(self._replace(process))
+
+    async def _replace(self, dead_process):
+        await dead_process.close()
+        process = await self._spawn()
+        self._processes[self._processes.index(dead_process)] = process
+        self._idle.put_nowait(process)
+
+    async def _finish_cancelled(self, process, results):
+        try:
+            await asyncio.wait_for(results, self.timeout)
+        except asyncio.TimeoutError:
+            process.timed_out = True
+            process.kill()
+        except RScriptError:
+            pass
+        self._recycle(process)
+
+    def _detach(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+
+
+# lets Qt code use an AsyncRSession without an asyncio aware Qt event loop
+# the session lives on its own event loop thread, results come back as a queued Qt signal
+class QtBridge(QObject):
+    # request id, result (None if it failed), error (None if it succeeded)
+    finished = pyqtSignal(int, object, object)
+
+    def __init__(self, size=R_POOL_SIZE, limit=None, cache=None, parent=None):
+        super().__init__(parent)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._request_ids = itertools.count(1)
+        self._futures = {}
+
+        self.session = self._call(self._create_session(size, limit, cache))
+
+    async def _create_session(self, size, limit, cache):
+        session = AsyncRSession(size, limit, cache)
+        await session.start()
+        return session
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+
+    def submit(self, script):
+        request_id = next(self._request_ids)
+        future = asyncio.run_coroutine_threadsafe(self.session.run(script), self._loop)
+        self._futures[request_id] = future
+        future.add_done_callback(lambda future: self._done(request_id, future))
+        return request_id
+
+    def cancel(self, request_id):
+        future = self._futures.get(request_id)
+        if future is not None:
+            future.cancel()
+
+    def _done(self, request_id, future):
+        self._futures.pop(request_id, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        self.finished.emit(request_id, None if error is not None else future.result(), error)
+
+    def close(self):
+        for future in list(self._futures.values()):
+            future.cancel()
+        self._call(self.session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
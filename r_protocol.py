@@ -0,0 +1,151 @@
+from array import array
+import struct
+import sys
+
+# framed responses from the R processes, written by the helpers in constants.CUSTOM_R_CODE
+# every frame is a little-endian int32 header (request id, channel, payload length) followed by the payload
+# requests are numbered by r_runner, so several of them can be in flight on one process
+# and their frames are matched by id instead of by position in the stream
+HEADER = struct.Struct("<iii")
+
+# channels (the R side uses the same numbers)
+OUTPUT = 1  # utf-8 text the script printed, a statement's worth at a time
+PLOT = 2    # one plot_line call, see decode_plot
+ERROR = 3   # utf-8 message of the error that stopped the script
+END = 4     # empty, the last frame of every request
+CHANNELS = (OUTPUT, PLOT, ERROR, END)
+
+
+# a frame that does not follow the layout, the rest of its channel can not be trusted either
+class ProtocolError(Exception):
+    pass
+
+
+def read_exact(channel, size):
+    data = channel.read(size)
+    if len(data) < size:
+        raise EOFError("response channel closed")
+    return data
+
+# (request id, channel, payload)
+def read_frame(channel):
+    request_id, kind, length = check_header(*HEADER.unpack(read_exact(channel, HEADER.size)))
+    return request_id, kind, read_exact(channel, length)
+
+# same for an asyncio.StreamReader, raises asyncio.IncompleteReadError once the channel is closed
+async def read_frame_async(reader):
+    request_id, kind, length = check_header(*HEADER.unpack(await reader.readexactly(HEADER.size)))
+    return request_id, kind, await reader.readexactly(length)
+
+def check_header(request_id, kind, length):
+    if kind not in CHANNELS or length < 0:
+        raise ProtocolError(f"bad frame header (channel {kind}, length {length})")
+    return request_id, kind, length
+
+
+def decode_text(payload):
+    return payload.decode(errors="replace")
+
+# result entries of an OUTPUT or PLOT frame (see r_runner.RProcess.results)
+# raises ProtocolError for a payload that does not decode
+def decode_entries(kind, payload):
+    if kind == OUTPUT:
+        return decode_text(payload).splitlines()
+    if kind == PLOT:
+        try:
+            return [decode_plot(payload)]
+        except (struct.error, ValueError, IndexError) as e:
+            raise ProtocolError(f"bad plot frame: {e}")
+    return []
+
+
+# plot payload: int32 length + utf-8 name, then four blocks of int32 count + float64s for xs, ys, range(xs), range(ys)
+# every block has to fit and the payload has to end with the last one
+def decode_plot(payload):
+    view = memoryview(payload)
+    (name_length,) = struct.unpack_from("<i", view, 0)
+    offset = 4 + name_length
+    if name_length < 0 or offset > len(view):
+        raise ValueError("name runs past the payload")
+    name = bytes(view[4:offset]).decode()
+
+    blocks = []
+    for _ in range(4):
+        (count,) = struct.unpack_from("<i", view, offset)
+        offset += 4
+        if count < 0 or offset + 8 * count > len(view):
+            raise ValueError("block runs past the payload")
+        values = array('d')
+        values.frombytes(view[offset:offset + 8 * count])
+        if sys.byteorder != "little":
+            values.byteswap()
+        blocks.append(values)
+        offset += 8 * count
+    if offset != len(view):
+        raise ValueError("bytes left after the last block")
+
+    xs, ys, x_range, y_range = blocks
+    if len(x_range) != 2 or len(y_range) != 2:
+        raise ValueError("a range block does not hold two values")
+    return make_line_plot(xs, ys, x_range, y_range, name)
+
+
+def make_line_plot(xs, ys, x_range, y_range, name):
+    return {
+        'xs': xs,
+        'ys': ys,
+        'x_range': (x_range[0], x_range[1]),
+        'y_range': (y_range[0], y_range[1]),
+        'name': name,
+    }
+
+
+# a whole result as frames (request id 0, no END frame), the reverse of decode_result
+# consecutive text lines share one OUTPUT frame, used to store results on disk (see disk_cache)
+def encode_result(result):
+    frames = []
+    lines = []
+    for entry in result:
+        if isinstance(entry, dict):
+            if lines:
+                frames.append(encode_frame(OUTPUT, "".join(line + "\n" for line in lines).encode()))
+                lines = []
+            frames.append(encode_frame(PLOT, encode_plot(entry)))
+        else:
+            lines.append(entry)
+    if lines:
+        frames.append(encode_frame(OUTPUT, "".join(line + "\n" for line in lines).encode()))
+    return b"".join(frames)
+
+# raises ProtocolError for data that encode_result did not write, like a damaged cache row
+def decode_result(data):
+    result = []
+    offset = 0
+    while offset < len(data):
+        try:
+            _, kind, length = check_header(*HEADER.unpack_from(data, offset))
+        except struct.error as e:
+            raise ProtocolError(f"bad result header: {e}")
+        offset += HEADER.size
+        if offset + length > len(data):
+            raise ProtocolError("frame runs past the result")
+        result.extend(decode_entries(kind, data[offset:offset + length]))
+        offset += length
+    return result
+
+def encode_frame(kind, payload):
+    return HEADER.pack(0, kind, len(payload)) + payload
+
+# same layout as decode_plot reads
+def encode_plot(plot):
+    name = plot['name'].encode()
+    parts = [struct.pack("<i", len(name)), name]
+    for values in (plot['xs'], plot['ys'], plot['x_range'], plot['y_range']):
+        if not isinstance(values, array) or values.typecode != 'd' or sys.byteorder != "little":
+            values = array('d', values)
+            if sys.byteorder != "little":
+                values.byteswap()
+        parts.append(struct.pack("<i", len(values)))
+        parts.append(values.tobytes())
+    return b"".join(parts)
+
@@ -1,65 +1,468 @@
+import socket
+import sqlite3
 import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
-from constants import CUSTOM_R_CODE
+from constants import CUSTOM_R_CODE, INCREMENTAL_EVALUATION, RESPONSE_CONNECT_TIMEOUT, R_POOL_SIZE, PREFETCH_LIMIT, RESULT_CACHE_MAX_BYTES, EVALUATION_TIMEOUT, R_MEMORY_LIMIT_BYTES, DISK_CACHE_PATH, DISK_CACHE_MAX_BYTES
+import disk_cache, r_protocol, r_syntax, result_cache, timing
 
-# persistent R interactive process
-R_PROCESS = 'NOT_YET_INITIALIZED'
+R_COMMAND = ["R", "--slave"]
 
-def spawn_R_PROCESS():
-    global R_PROCESS
-    R_PROCESS = subprocess.Popen(
-        ["R", "--slave"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
-    )
 
+try:
+    import resource
+except ImportError:
+    resource = None # no address space limit on this platform
 
-def run_r_script(script):
-    wrapped_script = f"""
-tryCatch({{
+
+# anything that kept a script from producing its full output
+class RScriptError(Exception):
+    pass
+
+# the script did not get past r_syntax.check and was never sent to R
+class RSyntaxError(RScriptError):
+    pass
+
+# the watchdog killed R because the script ran longer than EVALUATION_TIMEOUT
+class RTimeoutError(RScriptError):
+    pass
+
+# R exited in the middle of a script, usually because the memory limit or the OS killed it
+class RProcessDiedError(RScriptError):
+    pass
+
+# one persistent R interactive process, the pool below keeps several of them warm
+# scripts go in on stdin as serve() calls, their output comes back as r_protocol frames over a local socket
+class RProcess:
+    def __init__(self):
+        self.process = None
+        # socket file the r_protocol frames arrive on
+        self.response_channel = None
+        # set by the watchdog when it had to kill the process
+        self.timed_out = False
+        self._last_request = 0
+        # request id -> frames of that request that were read while waiting for another one
+        self._pending_frames = {}
+
+    def spawn(self):
+        self.process = subprocess.Popen(
+            R_COMMAND,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        limit_memory(self.process.pid)
+        # scripts never print to stdout themselves, whatever still ends up there is only worth a log line
+        threading.Thread(target=self.log_stray_output, args=(self.process.stdout,), daemon=True).start()
+        self.response_channel = self.open_response_channel()
+        self._pending_frames = {}
+        self.install_helpers()
+
+    def install_helpers(self):
+        self.process.stdin.write(helpers_script())
+        self.process.stdin.flush()
+
+    def log_stray_output(self, stdout):
+        for line in stdout:
+            print(f"R: {line.rstrip()}")
+
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def kill(self):
+        if self.is_alive():
+            self.process.kill()
+
+    def close(self):
+        self.kill()
+        for stream in (self.process.stdin, self.response_channel):
+            try:
+                if stream is not None:
+                    stream.close()
+            except OSError:
+                pass
+        self.process.wait()
+
+    def watchdog_kill(self):
+        self.timed_out = True
+        self.kill()
+
+    # the error for a process that stopped answering in the middle of a script
+    def death_error(self):
+        code = self.process.wait()
+        if self.timed_out:
+            return RTimeoutError(f"the script ran longer than {EVALUATION_TIMEOUT} seconds and was stopped")
+        if code < 0:
+            return RProcessDiedError(f"R was killed by signal {-code}")
+        return RProcessDiedError(f"R exited with code {code}")
+
+    # after a frame that does not decode the channel is out of step, the process is killed (and replaced by the pool)
+    def protocol_error(self, error):
+        self.kill()
+        self.process.wait()
+        return RProcessDiedError(f"unreadable response from R ({error}), R was restarted")
+
+
+    def open_response_channel(self):
+        server = socket.create_server(("127.0.0.1", 0))
+        server.settimeout(RESPONSE_CONNECT_TIMEOUT)
+        port = server.getsockname()[1]
+
+        self.process.stdin.write(response_channel_script(port))
+        self.process.stdin.flush()
+
+        try:
+            connection, _ = server.accept()
+        except OSError:
+            raise RProcessDiedError("R did not connect its response channel")
+        finally:
+            server.close()
+
+        connection.settimeout(None)
+        return connection.makefile("rb")
+
+
+    # sends a script to R without waiting for it, returns the request id to pass to results
+    # several scripts can be submitted before reading any results, R runs them one after the other
+    # every script gets a fresh environment on top of .helpers, thrown away afterwards
+    # (with INCREMENTAL_EVALUATION that environment is kept for the statements that did not change)
+    # the script is sent as a string and parsed by R inside serve(), so even code that got
+    # past r_syntax.check can only fail with an error, never leave R waiting for more input
+    def submit(self, script):
+        self._last_request += 1
+        request_id = self._last_request
+        call = serve_call(request_id, script)
+
+        for i in range(1,3):
+            try:
+                with timing.measure(timing.R_WRITE):
+                    self.process.stdin.write(call)
+                    self.process.stdin.flush()
+            except:
+                print("!!! R PROCESS DIED")
+                self.spawn()
+                continue
+            break
+        else:
+            raise RProcessDiedError("unable to respawn R")
+
+        self._pending_frames[request_id] = deque()
+        return request_id
+
+    # yields the text output lines of a submitted script as R prints them, with every plot_line call
+    # replaced by a dict holding its 'xs', 'ys' (as array('d')), 'x_range', 'y_range' and 'name'
+    # raises RScriptError once the output is over if the script failed
+    # frames of other requests that arrive in the meantime are kept for their own results call
+    # the results of every submitted request have to be read before the process is handed on
+    # a watchdog kills the process once the script runs longer than EVALUATION_TIMEOUT,
+    # which raises RTimeoutError and the process has to be replaced (see RProcessPool)
+    def results(self, request_id):
+        self.timed_out = False
+        watchdog = threading.Timer(EVALUATION_TIMEOUT, self.watchdog_kill)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            yield from self.read_results(request_id)
+        finally:
+            watchdog.cancel()
+            self._pending_frames.pop(request_id, None)
+
+    # the time spent waiting for frames is recorded as R compute, decoding them as read + parse
+    def read_results(self, request_id):
+        pending = self._pending_frames[request_id]
+        error = None
+        start = time.perf_counter()
+        compute = parse = 0.0
+        while True:
+            if pending:
+                kind, payload = pending.popleft()
+            else:
+                waited = time.perf_counter()
+                try:
+                    frame_request, kind, payload = r_protocol.read_frame(self.response_channel)
+                except EOFError:
+                    raise self.death_error()
+                except r_protocol.ProtocolError as e:
+                    raise self.protocol_error(e)
+                compute += time.perf_counter() - waited
+                if frame_request != request_id:
+                    if frame_request in self._pending_frames:
+                        self._pending_frames[frame_request].append((kind, payload))
+                    continue
+
+            if kind == r_protocol.END:
+                break
+            decoded = time.perf_counter()
+            if kind == r_protocol.ERROR:
+                error = r_protocol.decode_text(payload)
+                parse += time.perf_counter() - decoded
+            else:
+                try:
+                    entries = r_protocol.decode_entries(kind, payload)
+                except r_protocol.ProtocolError as e:
+                    raise self.protocol_error(e)
+                parse += time.perf_counter() - decoded
+                yield from entries
+
+        timing.RECORDER.record(timing.R_COMPUTE, start, compute)
+        timing.RECORDER.record(timing.READ_PARSE, start, parse)
+        if error is not None:
+            raise RScriptError(error.strip())
+
+    def stream(self, script):
+        return self.results(self.submit(script))
+
+    # the whole output of stream as a list
+    def run(self, script):
+        return list(self.stream(script))
+
+    def r_version(self):
+        return self.run('cat(R.version.string, "\\n")')[0]
+
+
+
+# N warm R processes, every request goes to whichever one is idle
+# idle processes can also evaluate scripts speculatively (see prefetch), so that
+# scrubbing onto a neighbouring slider step finds its result already computed
+class RProcessPool:
+    def __init__(self, size, cache):
+        self._cache = cache
+        # a disk_cache.Cache below the memory one, set by spawn_R_POOL once the R version is known
+        # results are written to it in the background
+        self.disk_cache = None
+        self._disk_writer = ThreadPoolExecutor(max_workers=1)
+        self._executor = ThreadPoolExecutor(max_workers=size)
+        self._condition = threading.Condition()
+        self._idle = []
+        # script key -> Future of a speculative run still in flight, oldest first
+        self._prefetched = OrderedDict()
+
+        # a process killed by the watchdog is swapped for this one, so the next request doesn't wait for R to start
+        self._spawner = ThreadPoolExecutor(max_workers=1)
+        self._spare = self._spawner.submit(spawn_warm_process)
+
+        # spawn in parallel, the empty run makes sure every R process is up before the first request
+        self._workers = list(self._executor.map(lambda _: spawn_warm_process(), range(size)))
+        self._idle = list(self._workers)
+
+
+    def _acquire(self, blocking=True, keep_idle=0):
+        with self._condition:
+            while len(self._idle) <= keep_idle:
+                if not blocking:
+                    return None
+                self._condition.wait()
+            return self._idle.pop()
+
+    def _release(self, worker):
+        if not worker.is_alive():
+            worker = self._replace(worker)
+        with self._condition:
+            self._idle.append(worker)
+            self._condition.notify()
+
+    def _replace(self, dead_worker):
+        dead_worker.close()
+        with self._condition:
+            spare = self._spare
+            self._spare = self._spawner.submit(spawn_warm_process)
+        worker = spare.result()
+        with self._condition:
+            self._workers[self._workers.index(dead_worker)] = worker
+        return worker
+
+
+    # the whole output, None if the script failed in any way (stream raises the reason instead)
+    # use_cache=False is for bulk work (like sweep.Sweeper) that would only flush the cache
+    def run(self, script, use_cache=True):
+        try:
+            return list(self.stream(script, use_cache))
+        except RScriptError:
+            return None
+
+    # same entries as run, yielded while R is still printing them
+    # the worker stays busy until the generator is exhausted or closed
+    # unparseable scripts fail right here, without ever reaching an R process
+    def stream(self, script, use_cache=True):
+        syntax_error = r_syntax.check(script)
+        if syntax_error is not None:
+            raise RSyntaxError(syntax_error)
+
+        key = result_cache.script_key(script)
+        result = self.cached_result(key) if use_cache else None
+        if result is not None:
+            yield from result
+            return
+
+        with self._condition:
+            future = self._prefetched.pop(key, None)
+        if future is not None:
+            result = future.result()
+            # a failed speculative run is evaluated again to get its error
+            if result is not None:
+                yield from result
+                return
+
+        # only results that fit in the cache are collected, the rest is just passed through
+        collected = [] if use_cache else None
+        collected_bytes = 0
+
+        worker = self._acquire()
+        entries = worker.stream(script)
+        finished = False
+        try:
+            for entry in entries:
+                if collected is not None:
+                    collected.append(entry)
+                    collected_bytes += result_cache.entry_size(entry)
+                    if collected_bytes > self._cache.max_bytes:
+                        collected = None
+                yield entry
+            finished = True
+            if collected is not None:
+                self.store(key, collected)
+        finally:
+            if finished:
+                self._release(worker)
+            else:
+                # a consumer that stopped early (like a superseded request) leaves output behind that has to be
+                # read before the next script, that happens in the background so the consumer can move on
+                self._executor.submit(self._drain, worker, entries)
+
+    def _drain(self, worker, entries):
+        try:
+            for entry in entries:
+                pass
+        except RScriptError:
+            pass
+        self._release(worker)
+
+    def size(self):
+        return len(self._workers)
+
+    # R.version.string of the processes, asked from an idle one
+    def r_version(self):
+        worker = self._acquire()
+        try:
+            return worker.r_version()
+        finally:
+            self._release(worker)
+
+    # memory first, then disk, a result found on disk is moved up into memory
+    def cached_result(self, key):
+        result = self._cache.get(key)
+        if result is None and self.disk_cache is not None:
+            result = self.disk_cache.get(key)
+            if result is not None:
+                self._cache.put(key, result)
+        return result
+
+    def store(self, key, result):
+        self._cache.put(key, result)
+        if self.disk_cache is not None:
+            self._disk_writer.submit(self.disk_cache.put, key, result)
+
+    # never blocks: the script is only evaluated if a worker is free
+    # one worker is always left idle for the next real request
+    def prefetch(self, script):
+        key = result_cache.script_key(script)
+        if key in self._cache or r_syntax.check(script) is not None:
+            return
+        with self._condition:
+            if key in self._prefetched:
+                return
+        worker = self._acquire(blocking=False, keep_idle=1)
+        if worker is None:
+            return
+
+        # a result already on disk only needs to be loaded
+        def speculate():
+            try:
+                result = self.cached_result(key)
+                if result is None:
+                    result = worker.run(script)
+                    self.store(key, result)
+            except RScriptError:
+                result = None
+            finally:
+                self._release(worker)
+
+            with self._condition:
+                self._prefetched.pop(key, None)
+            return result
+
+        with self._condition:
+            self._prefetched[key] = self._executor.submit(speculate)
+            while len(self._prefetched) > PREFETCH_LIMIT:
+                self._prefetched.popitem(last=False)
+
+
+def spawn_warm_process():
+    process = RProcess()
+    process.spawn()
+    process.run("")
+    return process
+
+# set from this process right after the spawn, a preexec_fn is not safe to run in a fork of a threaded process
+# allocations past the limit then fail inside R with an error
+def limit_memory(pid):
+    if resource is None or not hasattr(resource, 'prlimit') or not R_MEMORY_LIMIT_BYTES:
+        return
+    try:
+        resource.prlimit(pid, resource.RLIMIT_AS, (R_MEMORY_LIMIT_BYTES, R_MEMORY_LIMIT_BYTES))
+    except ProcessLookupError:
+        pass # R already exited, the caller finds out when it talks to it
+
+
+# what gets written to the stdin of a new R process, in this order (see RProcess.spawn)
+def response_channel_script(port):
+    return f'.response_con <- socketConnection(host = "127.0.0.1", port = {port}, blocking = TRUE, open = "wb")\n'
+
+def helpers_script():
+    return f"""
+.helpers <- local({{
     {CUSTOM_R_CODE}
-    {script}
-    cat("\\nEND_OF_OUTPUT\\n")
-}}, error = function(e) {{
-    cat("\\nERROR:", e$message, "\\n")
-    cat("\\nEND_OF_OUTPUT\\n")
+    environment()
 }})
 """
-    for i in range(1,3):
+
+def serve_call(request_id, script):
+    return f".helpers$serve({request_id}, {r_string_literal(script)}, {'TRUE' if INCREMENTAL_EVALUATION else 'FALSE'})\n"
+
+
+R_POOL = 'NOT_YET_INITIALIZED'
+RESULT_CACHE = result_cache.Cache(RESULT_CACHE_MAX_BYTES)
+
+DISK_CACHE = 'NOT_YET_INITIALIZED'
+
+# the disk cache is keyed by the R version and the helper code too, results of another R or older helpers never match
+def spawn_R_POOL():
+    global R_POOL, DISK_CACHE
+    R_POOL = RProcessPool(R_POOL_SIZE, RESULT_CACHE)
+    if DISK_CACHE_MAX_BYTES:
         try:
-            R_PROCESS.stdin.write(wrapped_script + "\n")
-            R_PROCESS.stdin.flush()
-        except:
-            print("!!! R PROCESS DIED")
-            spawn_R_PROCESS()
-            # this here, is an extremely lazy thing
-            # if we send unfinished code to the R process, it may simply give up and exit
-            # instead of trying to detect valid R code, we just respawn and kill as many processes as needed
-            # this is why writing code directly in the editor is quite slow.
-            # it may be spawning a process for every letter typed in an unfinished code that will cause the interpreter to exit :/
-            continue
-        break
-    else:
-        print("!!! UNABLE TO RESPAWN R PROCESS")
-        exit()
-    
-    output = []
-    while True:
-        line = R_PROCESS.stdout.readline()
-        if not line:
-            break  # Process died?
-        line = line.strip()
-        if line == "END_OF_OUTPUT":
-            break
-        output.append(line)
-    
-    for line in output:
-        if line.startswith("ERROR:"):
-            print(f"R Error: {line}")
-            return None
-    
-    return output
+            DISK_CACHE = disk_cache.Cache(DISK_CACHE_PATH, DISK_CACHE_MAX_BYTES, R_POOL.r_version() + helpers_script())
+        except (OSError, sqlite3.Error, RScriptError) as e:
+            print(f"!!! NO DISK CACHE: {e}")
+        else:
+            R_POOL.disk_cache = DISK_CACHE
+
+def run_r_script(script):
+    return R_POOL.run(script)
+
+def stream_r_script(script):
+    return R_POOL.stream(script)
+
+def prefetch_r_script(script):
+    R_POOL.prefetch(script)
+
+
+def r_string_literal(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
 
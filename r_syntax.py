@@ -0,0 +1,86 @@
+import re
+
+# cheap python side check that a script is complete enough to hand to R
+# only strings, comments and bracket nesting are tokenized, everything else is R's job (parse() still runs there)
+# returns None when the script looks fine, otherwise a message for the first problem found
+
+CLOSING = {'(': ')', '[': ']', '{': '}'}
+OPENING = {')': '(', ']': '[', '}': '{'}
+
+# a script ending in one of these is still waiting for its right hand side
+TRAILING_OPERATOR_PATTERN = re.compile(r'(<<?-|->>?|\|>|%[^%\n]*%|&&?|\|\|?|[-+*/^~=,$@:!<>])$')
+RAW_STRING_PATTERN = re.compile(r'[rR](["\'])(-*)([(\[{])')
+
+
+def check(script):
+    stack = []  # (bracket, line)
+    line = 1
+    last_token_end = 0
+    i = 0
+    n = len(script)
+    while i < n:
+        char = script[i]
+
+        if char == '\n':
+            line += 1
+        elif char == '#':
+            end = script.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        elif char in '"\'`':
+            end = string_end(script, i + 1, char)
+            if end == -1:
+                return f"line {line}: unterminated string"
+            line += script.count('\n', i, end)
+            i = end
+            last_token_end = i
+            continue
+        elif char in 'rR' and (i == 0 or not is_name_char(script[i - 1])):
+            match = RAW_STRING_PATTERN.match(script, i)
+            if match:
+                quote, dashes, bracket = match.groups()
+                terminator = CLOSING[bracket] + dashes + quote
+                end = script.find(terminator, match.end())
+                if end == -1:
+                    return f"line {line}: unterminated raw string"
+                end += len(terminator)
+                line += script.count('\n', i, end)
+                i = end
+                last_token_end = i
+                continue
+        elif char in CLOSING:
+            stack.append((char, line))
+        elif char in OPENING:
+            if not stack:
+                return f"line {line}: unexpected '{char}'"
+            bracket, opened_line = stack.pop()
+            if bracket != OPENING[char]:
+                return f"line {line}: '{char}' does not match '{bracket}' from line {opened_line}"
+
+        if not char.isspace():
+            last_token_end = i + 1
+        i += 1
+
+    if stack:
+        bracket, opened_line = stack[-1]
+        return f"line {opened_line}: '{bracket}' is never closed"
+
+    if TRAILING_OPERATOR_PATTERN.search(script[:last_token_end]):
+        return f"line {line}: incomplete expression at the end of the script"
+    return None
+
+
+# index just past the closing quote, -1 if the string never ends
+def string_end(script, i, quote):
+    n = len(script)
+    while i < n:
+        if script[i] == '\\':
+            i += 2
+            continue
+        if script[i] == quote:
+            return i + 1
+        i += 1
+    return -1
+
+def is_name_char(char):
+    return char.isalnum() or char in '._'
@@ -0,0 +1,82 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+import threading
+
+from constants import STREAM_BATCH_LINES
+import r_runner, timing
+
+
+# runs R scripts off the GUI thread
+# only the newest submitted script is kept, older ones that did not start yet are dropped
+# and output of requests that got superseded while R was busy is never emitted
+# output is emitted in batches while R is still running, so plots show up one by one
+class Worker(QThread):
+    # request id, list of the next entries of the r_runner result
+    entries_ready = pyqtSignal(int, object)
+    # request id, None when the script ran without errors, otherwise the exception that stopped it
+    # (an r_runner.RScriptError unless something unexpected broke, emitted after its last entries)
+    result_ready = pyqtSignal(int, object)
+
+    def __init__(self):
+        super().__init__()
+        self._condition = threading.Condition()
+        self._pending_script = None
+        self._latest_request = 0
+        self._stopping = False
+
+    def submit(self, script):
+        with self._condition:
+            if self._pending_script is not None:
+                timing.RECORDER.count(timing.FRAMES_DROPPED)
+            self._latest_request += 1
+            self._pending_script = script
+            self._condition.notify()
+            return self._latest_request
+
+    # drops the pending script and makes whatever is running stale
+    def cancel(self):
+        with self._condition:
+            self._latest_request += 1
+            self._pending_script = None
+
+    def is_latest(self, request_id):
+        return request_id == self._latest_request
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self.wait()
+
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._pending_script is None and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                script = self._pending_script
+                request_id = self._latest_request
+                self._pending_script = None
+
+            # text lines are batched, a plot is sent right away together with the lines before it
+            batch = []
+            error = None
+            try:
+                for entry in r_runner.stream_r_script(script):
+                    if not self.is_latest(request_id):
+                        break
+                    batch.append(entry)
+                    if isinstance(entry, dict) or len(batch) >= STREAM_BATCH_LINES:
+                        self.entries_ready.emit(request_id, batch)
+                        batch = []
+            except Exception as e:
+                # anything escaping run() would abort the whole application
+                error = e
+
+            if not self.is_latest(request_id):
+                timing.RECORDER.count(timing.FRAMES_DROPPED)
+            else:
+                if batch:
+                    self.entries_ready.emit(request_id, batch)
+                self.result_ready.emit(request_id, error)
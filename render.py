@@ -0,0 +1,180 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+from constants import RENDER_WIDTH, RENDER_HEIGHT, RENDER_PNG_QUALITY
+import sliders
+
+# headless batch rendering: evaluates a script for every combination of the given slider values
+# and writes each frame as a PNG or SVG drawn by graph.Widget, spread over a pool of worker processes
+# every worker keeps its own Qt (offscreen platform) and R process, neighbouring frames go to the same
+# worker so incremental evaluation only has to re-run what the changed slider touches
+#
+#   python render.py R/demo.R --sweep a --set b=1,2,3 -o frames --format svg
+
+
+# per worker process state, see init_worker
+WORKER = 'NOT_YET_INITIALIZED'
+
+class Worker:
+    def __init__(self, options):
+        # imported here so the parent process never loads Qt
+        from PyQt6.QtWidgets import QApplication
+        import graph, r_runner
+
+        self.application = QApplication([])
+        self.r_process = r_runner.spawn_warm_process()
+        self.options = options
+
+        self.graph_widget = graph.Widget()
+        self.graph_widget.resize(options.width, options.height)
+        self.graph_widget.draw_points = options.points
+        self.graph_widget.one_to_one_scaling = options.one_to_one
+
+    # (index, None) or (index, error message)
+    def render(self, index, script):
+        import r_runner
+        try:
+            result = self.r_process.run(script)
+        except r_runner.RScriptError as e:
+            if not self.r_process.is_alive():
+                self.r_process = r_runner.spawn_warm_process()
+            return index, str(e)
+
+        self.graph_widget.clear()
+        for entry in result:
+            if isinstance(entry, dict):
+                self.graph_widget.add_line_data(entry['xs'], entry['ys'], *entry['x_range'], *entry['y_range'], entry['name'])
+
+        path = frame_path(self.options, index)
+        if self.options.format == 'svg':
+            self.render_svg(path)
+        else:
+            self.render_png(path)
+        return index, None
+
+    def render_png(self, path):
+        from PyQt6.QtCore import Qt
+        from PyQt6.QtGui import QImage, QPainter
+
+        image = QImage(self.options.width, self.options.height, QImage.Format.Format_RGB32)
+        image.fill(Qt.GlobalColor.white)
+        painter = QPainter(image)
+        self.graph_widget.paint(painter)
+        painter.end()
+        image.save(path, "PNG", self.options.png_quality)
+
+    def render_svg(self, path):
+        from PyQt6.QtCore import QRect, QSize
+        from PyQt6.QtGui import QPainter
+        from PyQt6.QtSvg import QSvgGenerator
+
+        generator = QSvgGenerator()
+        generator.setFileName(path)
+        generator.setSize(QSize(self.options.width, self.options.height))
+        generator.setViewBox(QRect(0, 0, self.options.width, self.options.height))
+        painter = QPainter(generator)
+        self.graph_widget.paint(painter, vector=True)
+        painter.end()
+
+
+def init_worker(options):
+    global WORKER
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    WORKER = Worker(options)
+
+def render_frame(task):
+    return WORKER.render(*task)
+
+
+def frame_path(options, index):
+    return os.path.join(options.output, f"{options.prefix}{index:05d}.{options.format}")
+
+
+# slider name -> list of values to render, from --set and --sweep
+def requested_values(options, specs):
+    values = {}
+    by_name = {spec.name: spec for spec in specs}
+    for name in options.sweep:
+        if name not in by_name:
+            raise SystemExit(f"no slider named {name!r}")
+        values[name] = by_name[name].values()
+    for assignment in options.set:
+        name, _, listed = assignment.partition('=')
+        if name not in by_name:
+            raise SystemExit(f"no slider named {name!r}")
+        try:
+            values[name] = [float(value) for value in listed.split(',')]
+        except ValueError:
+            raise SystemExit(f"bad values in --set {assignment}")
+    return values
+
+# every combination of slider values, the last slider changes fastest
+def value_grid(specs, values):
+    axes = [values.get(spec.name, [spec.initial_value()]) for spec in specs]
+    return [list(combination) for combination in itertools.product(*axes)]
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="Render an R script for a grid of slider values without a window.")
+    parser.add_argument("script", help="R script using slider() and plot_line() / plot_func()")
+    parser.add_argument("-o", "--output", default="frames", help="directory for the frames (default: frames)")
+    parser.add_argument("--prefix", default="frame_", help="file name prefix of every frame")
+    parser.add_argument("--format", choices=["png", "svg"], default="png")
+    parser.add_argument("--png-quality", type=int, default=RENDER_PNG_QUALITY, help="0 (smallest files) to 100 (fastest to write)")
+    parser.add_argument("--width", type=int, default=RENDER_WIDTH)
+    parser.add_argument("--height", type=int, default=RENDER_HEIGHT)
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=V1,V2,...", help="render these values of a slider")
+    parser.add_argument("--sweep", action="append", default=[], metavar="NAME", help="render every step of a slider")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: one per core)")
+    parser.add_argument("--points", action="store_true", help="draw points instead of lines")
+    parser.add_argument("--one-to-one", action="store_true", help="use 1:1 scaling")
+    return parser.parse_args(args)
+
+
+def main(args):
+    options = parse_args(args)
+    with open(options.script) as file:
+        code = file.read()
+
+    specs = []
+    for line in sliders.slider_lines(code):
+        spec = sliders.parse_line(line)
+        if spec is not None:
+            specs.append(spec)
+
+    grid = value_grid(specs, requested_values(options, specs))
+    tasks = [(index, sliders.substitute(code, values)) for index, values in enumerate(grid)]
+    os.makedirs(options.output, exist_ok=True)
+
+    # which values every frame was rendered with
+    with open(os.path.join(options.output, f"{options.prefix}index.csv"), "w") as file:
+        file.write(",".join(["frame"] + [spec.name for spec in specs]) + "\n")
+        for index, values in enumerate(grid):
+            file.write(",".join([os.path.basename(frame_path(options, index))] + [str(value) for value in values]) + "\n")
+
+    workers = max(1, min(options.workers, len(tasks)))
+    # contiguous chunks keep consecutive slider steps on one worker
+    chunk_size = max(1, len(tasks) // (workers * 4))
+
+    start = time.perf_counter()
+    failed = 0
+    # Qt does not survive a fork, the workers start from scratch
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=init_worker, initargs=(options,)) as pool:
+        for index, error in pool.imap_unordered(render_frame, tasks, chunk_size):
+            if error is not None:
+                failed += 1
+                print(f"frame {index}: {error}", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    rendered = len(tasks) - failed
+    print(f"{rendered} frames ({failed} failed) in {elapsed:.2f}s with {workers} workers, {rendered / elapsed:.1f} frames/sec")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
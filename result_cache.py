@@ -0,0 +1,78 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def script_key(script):
+    return hashlib.sha256(script.encode()).hexdigest()
+
+
+# rough memory footprint of a parsed r_runner result
+def result_size(result):
+    return 64 + sum(entry_size(entry) for entry in result)
+
+def entry_size(entry):
+    if isinstance(entry, dict):
+        return (200 + len(entry['name'])
+                + entry['xs'].itemsize * len(entry['xs'])
+                + entry['ys'].itemsize * len(entry['ys']))
+    return 50 + len(entry)
+
+
+# memoizes parsed r_runner results, keyed by script_key of the fully substituted script
+# least recently used results are evicted once their total size goes over max_bytes
+# cached results are shared between callers and must not be modified
+class Cache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, result):
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+
+            self._entries[key] = (result, size)
+            self._total_bytes += size
+
+            while self._total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,60 @@
+from PyQt6.QtCore import QObject, QTimer
+import math
+import time
+
+
+# coalesces bursts of GUI events into at most one callback per frame
+# every task has a key, scheduling a key that is already waiting replaces it (only the newest one runs)
+# a delay debounces a task: it only runs once nothing rescheduled it for that long
+# when several tasks are due, the one with the highest priority runs first, the rest wait for the next frame
+class Scheduler(QObject):
+    def __init__(self, frame_ms, parent=None):
+        super().__init__(parent)
+        self._frame = frame_ms / 1000
+        self._tasks = {}  # key -> (priority, due time, callback)
+        self._last_run = float('-inf')
+        # diagnostics: callbacks run and schedule calls that replaced a waiting task
+        self.runs = 0
+        self.coalesced = 0
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._run_next)
+
+    def schedule(self, key, callback, priority=0, delay_ms=0):
+        if key in self._tasks:
+            self.coalesced += 1
+        self._tasks[key] = (priority, time.monotonic() + delay_ms / 1000, callback)
+        self._arm()
+
+    def cancel(self, key):
+        self._tasks.pop(key, None)
+        self._arm()
+
+    def clear(self):
+        self._tasks.clear()
+        self._timer.stop()
+
+    # number of tasks waiting to run
+    def queue_depth(self):
+        return len(self._tasks)
+
+
+    def _arm(self):
+        if not self._tasks:
+            self._timer.stop()
+            return
+        due = min(due_time for _, due_time, _ in self._tasks.values())
+        start = max(due, self._last_run + self._frame)
+        self._timer.start(max(0, math.ceil((start - time.monotonic()) * 1000)))
+
+    def _run_next(self):
+        now = time.monotonic()
+        due_keys = [key for key, (_, due_time, _) in self._tasks.items() if due_time <= now]
+        if due_keys:
+            key = max(due_keys, key=lambda key: self._tasks[key][0])
+            _, _, callback = self._tasks.pop(key)
+            self._last_run = now
+            self.runs += 1
+            callback()
+        self._arm()
@@ -0,0 +1,38 @@
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import QWidget, QHBoxLayout, QLabel, QSizePolicy
+
+import float_slider
+
+
+# one row of the slider panel: the range of the slider, the slider itself and its current value
+# made from a sliders.Spec, a changed spec is applied in place (see update_spec)
+class Widget(QWidget):
+    def __init__(self, spec):
+        super().__init__()
+        self.spec = spec
+        self.setContentsMargins(5, 5, 5, 5)
+        layout = QHBoxLayout(self)
+
+        self.info_label = QLabel(info_text(spec))
+        self.info_label.setFixedWidth(100)
+
+        value_label = QLabel()
+        value_label.setFixedWidth(60)
+        value_label.setAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+
+        self.slider = float_slider.Widget(spec.min_val, spec.max_val, spec.step_val, spec.default_val, value_label, spec.name, Qt.Orientation.Horizontal)
+        self.slider.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
+
+        layout.addWidget(self.info_label)
+        layout.addWidget(self.slider)
+        layout.addWidget(value_label)
+
+    # keeps the current value, as far as the new range and step allow
+    def update_spec(self, spec):
+        self.slider.set_range(spec.min_val, spec.max_val, spec.step_val, self.slider.get_value())
+        self.info_label.setText(info_text(spec))
+        self.spec = spec
+
+
+def info_text(spec):
+    return f"{spec.min_val}-{spec.max_val}\nStep: {spec.step_val}"
@@ -0,0 +1,83 @@
+import functools
+import math
+import re
+
+import misc
+from constants import SLIDER_REGEX_PATTERN, SLIDER_REGEX_CAPTURE_PATTERN, SLIDER_PARSE_CACHE_SIZE
+
+# parsing and substitution of the slider(min, max, [step], [default]) calls in a script
+# shared by the window (app.py) and the headless renderer (render.py)
+
+SLIDER_REGEX = re.compile(SLIDER_REGEX_PATTERN)
+SLIDER_CAPTURE_REGEX = re.compile(SLIDER_REGEX_CAPTURE_PATTERN)
+
+
+# one parsed slider line, the values it can take are the same as in float_slider.Widget
+# specs are shared through the parse_line cache and must not be modified
+class Spec:
+    def __init__(self, name, min_val, max_val, step_val, default_val):
+        self.name = name
+        self.min_val = min_val
+        self.max_val = max_val
+        self.step_val = step_val
+        self.default_val = default_val
+
+    def fields(self):
+        return (self.name, self.min_val, self.max_val, self.step_val, self.default_val)
+
+    def __eq__(self, other):
+        return isinstance(other, Spec) and self.fields() == other.fields()
+
+    def __hash__(self):
+        return hash(self.fields())
+
+    def number_of_steps(self):
+        return math.floor((self.max_val - self.min_val) / self.step_val)
+
+    def values(self):
+        return [misc.scaled_to_value(self.min_val, self.step_val, scaled) for scaled in range(self.number_of_steps() + 1)]
+
+    # the value a fresh slider starts at
+    def initial_value(self):
+        max_val = self.min_val + self.number_of_steps() * self.step_val
+        snapped = misc.snap(self.min_val, max_val, self.step_val, self.default_val)
+        return misc.scaled_to_value(self.min_val, self.step_val, misc.value_to_scaled(self.min_val, self.step_val, snapped))
+
+
+# the lines of the script that call slider(), in order
+# runs on every keystroke, the plain substring test skips the regex for almost every line
+def slider_lines(code):
+    return [line for line in code.strip().split("\n") if "slider(" in line and SLIDER_CAPTURE_REGEX.search(line)]
+
+# None if the line does not hold a usable slider
+# lines are parsed once, an edit elsewhere in the script finds every slider line in the cache
+@functools.lru_cache(maxsize=SLIDER_PARSE_CACHE_SIZE)
+def parse_line(line):
+    match = SLIDER_CAPTURE_REGEX.search(line)
+    try:
+        name = line.split('<-')[0].strip()
+        parts = [p.strip() for p in match.group(1).split(',')]
+        min_val = float(parts[0])
+        max_val = float(parts[1])
+        step_val = float(parts[2]) if len(parts) > 2 else 1
+        default_val = float(parts[3]) if len(parts) > 3 else min_val
+    except:
+        return None # if we fail to parse, just invalidate this line
+
+    if step_val == 0:
+        return None # prevent division by 0
+    return Spec(name, min_val, max_val, step_val, default_val)
+
+
+# replaces the slider() calls of the script with the given values, in order
+def substitute(code, slider_values):
+    index = 0
+    def replace_match(match):
+        nonlocal index
+        if index < len(slider_values):
+            index += 1
+            return str(slider_values[index - 1])
+        else:
+            return match.group()
+
+    return SLIDER_REGEX.sub(replace_match, code)
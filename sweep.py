@@ -0,0 +1,125 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+
+import r_protocol, r_runner
+from constants import SWEEP_MAX_STEPS, SWEEP_MAX_BYTES
+
+
+# precomputed results for every step combination of a script's sliders
+# all plot vectors live in one array('d'), each cell only keeps offsets into it
+class Table:
+    def __init__(self, code, step_counts):
+        self.code = code
+        self.step_counts = step_counts
+        self.data = array('d')
+        self._text_bytes = 0
+
+        total = 1
+        for count in step_counts:
+            total *= count
+        self.cells = [None] * total
+
+    def cell_index(self, indices):
+        index = 0
+        for i, count in zip(indices, self.step_counts):
+            index = index * count + i
+        return index
+
+    def store(self, index, result):
+        cell = []
+        for entry in result:
+            if isinstance(entry, dict):
+                offset = len(self.data)
+                self.data.extend(entry['xs'])
+                self.data.extend(entry['ys'])
+                cell.append((entry['name'], offset, len(entry['xs']), len(entry['ys']), entry['x_range'], entry['y_range']))
+            else:
+                self._text_bytes += len(entry)
+                cell.append(entry)
+        # the data is in place before the cell becomes visible to lookup on the GUI thread
+        self.cells[index] = cell
+
+    # same layout as r_runner results, None if that combination was not computed (yet)
+    def lookup(self, indices):
+        cell = self.cells[self.cell_index(indices)]
+        if cell is None:
+            return None
+
+        result = []
+        for entry in cell:
+            if isinstance(entry, tuple):
+                name, offset, x_count, y_count, x_range, y_range = entry
+                xs = self.data[offset:offset + x_count]
+                ys = self.data[offset + x_count:offset + x_count + y_count]
+                result.append(r_protocol.make_line_plot(xs, ys, x_range, y_range, name))
+            else:
+                result.append(entry)
+        return result
+
+    def size_bytes(self):
+        return self.data.itemsize * len(self.data) + self._text_bytes + 8 * len(self.cells)
+
+
+
+# fills a Table in the background, spreading the evaluations over the R process pool
+# one R process is left for the interactive requests
+class Sweeper(QThread):
+    # cells done, cells total
+    progress = pyqtSignal(int, int)
+    # None when the whole sweep finished, otherwise the reason it stopped early
+    stopped = pyqtSignal(object)
+
+    # slider_values holds every value of every slider, script_for(values) substitutes one combination into the code
+    def __init__(self, code, slider_values, script_for):
+        super().__init__()
+        self.table = Table(code, [len(values) for values in slider_values])
+        self._slider_values = slider_values
+        self._script_for = script_for
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        total = len(self.table.cells)
+        if total > SWEEP_MAX_STEPS:
+            self.stopped.emit(f"sweep needs {total} evaluations, the limit is {SWEEP_MAX_STEPS}")
+            return
+
+        combinations = [[]]
+        for values in self._slider_values:
+            combinations = [combination + [i] for combination in combinations for i in range(len(values))]
+
+        parallelism = max(1, r_runner.R_POOL.size() - 1)
+        reason = None
+        done = 0
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            # anything escaping run() would abort the whole application (and leave the sweep button waiting)
+            try:
+                futures = {}
+                for indices in combinations:
+                    values = [self._slider_values[k][i] for k, i in enumerate(indices)]
+                    futures[executor.submit(r_runner.R_POOL.run, self._script_for(values), False)] = indices
+
+                for future in as_completed(futures):
+                    result = future.result()
+                    if self._cancelled.is_set():
+                        reason = "cancelled"
+                    elif result is not None: # failed combinations stay empty and fall back to R
+                        self.table.store(self.table.cell_index(futures[future]), result)
+                        if self.table.size_bytes() > SWEEP_MAX_BYTES:
+                            reason = f"sweep went over its {SWEEP_MAX_BYTES // (1024 * 1024)} MB budget"
+
+                    if reason is not None:
+                        executor.shutdown(wait=True, cancel_futures=True)
+                        break
+
+                    done += 1
+                    self.progress.emit(done, total)
+            except Exception as e:
+                reason = f"sweep failed: {e}"
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        self.stopped.emit(reason)
@@ -0,0 +1,58 @@
+import math
+import os
+import shutil
+import sys
+import unittest
+
+# runs plot_func(adaptive = TRUE) in a real R process, skipped where there is no R on PATH
+#
+#   python -m unittest discover tests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import r_runner
+
+
+@unittest.skipUnless(shutil.which(r_runner.R_COMMAND[0]), "R is not installed")
+class AdaptiveSamplesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.process = r_runner.spawn_warm_process()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.process.close()
+
+    def plot(self, script):
+        entries = self.process.run(script)
+        plots = [entry for entry in entries if isinstance(entry, dict)]
+        lines = [entry for entry in entries if isinstance(entry, str)]
+        self.assertEqual(len(plots), 1)
+        return plots[0], lines
+
+    # sqrt is undefined on the left half: only the edge at 0 gets refined, the gap itself does not eat max_points
+    def test_partially_undefined_function(self):
+        plot, lines = self.plot("plot_func(sqrt, seq(-5, 5, length.out = 2), adaptive = TRUE, max_points = 500)")
+        xs, ys = plot['xs'], plot['ys']
+
+        self.assertLess(len(xs), 500)
+        self.assertEqual(list(xs), sorted(xs))
+        undefined = [x for x, y in zip(xs, ys) if not math.isfinite(y)]
+        self.assertTrue(all(x < 0 for x in undefined))
+        self.assertLess(len(undefined), 100)
+        # the edge is found down to the sampling resolution
+        self.assertGreater(max(undefined), -1e-6)
+        self.assertGreater(sum(1 for x in xs if x >= 0), 33)
+        self.assertEqual(lines, ["Warning: NaNs produced"])
+
+    def test_defined_function_uses_its_budget_where_it_bends(self):
+        plot, lines = self.plot("plot_func(function(x) sin(1 / x), seq(0.01, 1, length.out = 2), adaptive = TRUE, max_points = 300)")
+        self.assertEqual(len(plot['xs']), 300)
+        self.assertTrue(all(map(math.isfinite, plot['ys'])))
+        self.assertGreater(sum(1 for x in plot['xs'] if x < 0.1), 100)
+        self.assertEqual(lines, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
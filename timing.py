@@ -0,0 +1,102 @@
+from collections import deque
+import json
+import os
+import threading
+import time
+
+from constants import TIMING_BUFFER_SIZE
+
+# per stage timings of the slider -> R -> screen pipeline
+# every measurement is one (stage, start, duration, thread id) tuple in a fixed size ring buffer,
+# appending to a deque is cheap and thread safe, so stages are always recorded
+# the graph widget can overlay p50/p95 per stage, export_json / export_chrome_trace write them out for offline analysis
+
+# stage names, in pipeline order (the overlay lists them like this)
+SUBSTITUTE = "substitute"
+R_WRITE = "R write"
+R_COMPUTE = "R compute"
+READ_PARSE = "read + parse"
+ADD_LINE_DATA = "add_line_data"
+PAINT = "paint"
+STAGES = [SUBSTITUTE, R_WRITE, R_COMPUTE, READ_PARSE, ADD_LINE_DATA, PAINT]
+
+# counters
+FRAMES_DROPPED = "frames dropped"  # evaluations that finished after a newer one superseded them
+POINTS_DRAWN = "points drawn"      # set by every paint, not accumulated
+
+
+class Recorder:
+    def __init__(self, capacity):
+        self.origin = time.perf_counter()
+        self.samples = deque(maxlen=capacity)
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, start, duration):
+        self.samples.append((stage, start, duration, threading.get_ident()))
+
+    def count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def set(self, counter, value):
+        self.counters[counter] = value
+
+    def clear(self):
+        self.samples.clear()
+        self.counters = {}
+
+    # stage -> (number of samples, p50, p95) in seconds, over what is still in the buffer
+    def summary(self):
+        durations = {}
+        for stage, _, duration, _ in list(self.samples):
+            durations.setdefault(stage, []).append(duration)
+        summary = {}
+        for stage, values in durations.items():
+            values.sort()
+            summary[stage] = (len(values), percentile(values, 50), percentile(values, 95))
+        return summary
+
+    def export_json(self, path):
+        data = {
+            "stages": {stage: {"count": count, "p50": p50, "p95": p95} for stage, (count, p50, p95) in self.summary().items()},
+            "counters": dict(self.counters),
+            "samples": [
+                {"stage": stage, "start": start - self.origin, "duration": duration, "thread": thread}
+                for stage, start, duration, thread in list(self.samples)
+            ],
+        }
+        with open(path, "w") as file:
+            json.dump(data, file, indent=1)
+
+    # the trace event format chrome://tracing and Perfetto open, one complete ("X") event per sample
+    def export_chrome_trace(self, path):
+        events = [
+            {"name": stage, "cat": "pipeline", "ph": "X", "pid": os.getpid(), "tid": thread,
+             "ts": (start - self.origin) * 1e6, "dur": duration * 1e6}
+            for stage, start, duration, thread in list(self.samples)
+        ]
+        for counter, value in self.counters.items():
+            events.append({"name": counter, "ph": "C", "pid": os.getpid(), "ts": (time.perf_counter() - self.origin) * 1e6, "args": {counter: value}})
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+# times the body of a with statement
+class measure:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        RECORDER.record(self.stage, self.start, time.perf_counter() - self.start)
+
+
+def percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, round(percent / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+RECORDER = Recorder(TIMING_BUFFER_SIZE)